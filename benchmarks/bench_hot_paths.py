@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pymongo import MongoClient  # noqa: E402
+
+from bot.cache import GuildCache, UserStatsWriter  # noqa: E402
+from bot.db import DB, AsyncDB  # noqa: E402
+from bot.game import WordChainGame  # noqa: E402
+from bot.model import Guild  # noqa: E402
+from bot.outbox import Outbox  # noqa: E402
+
+BENCH_DATABASE = 'kkeutmal_bench'
+BENCH_GUILD_ID = 1
+BENCH_CHANNEL_ID = 2
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        'iterations': len(latencies),
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'ops_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(func: Callable[[int], Any], iterations: int) -> Dict[str, float]:
+    latencies = []
+    started_at = time.perf_counter()
+    for i in range(iterations):
+        op_started_at = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - op_started_at)
+    return summarize(latencies, time.perf_counter() - started_at)
+
+
+async def measure_async(func: Callable[[int], Awaitable[Any]], iterations: int,
+                        prepare: Optional[Callable[[int], Any]] = None) -> Dict[str, float]:
+    """
+    Like measure, but awaits func. prepare runs before every iteration and is not timed.
+    """
+    latencies = []
+    timed = 0.0
+    for i in range(iterations):
+        argument = prepare(i) if prepare else i
+        op_started_at = time.perf_counter()
+        await func(argument)
+        latency = time.perf_counter() - op_started_at
+        latencies.append(latency)
+        timed += latency
+    return summarize(latencies, timed)
+
+
+def synthetic_dictionary(word_count: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Random words built from a few hundred syllables, so that chains can actually be played on them.
+    """
+    rng = random.Random(seed)
+    syllables = [chr(0xAC00 + rng.randrange(11172)) for _ in range(400)]
+    words = set()
+    while len(words) < word_count:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.choice((2, 2, 2, 3, 3, 4)))))
+
+    documents = []
+    for word in sorted(words):
+        for word_number in range(1, rng.choice((2, 2, 2, 3)) + 1):
+            documents.append({
+                'word': word,
+                'word_number': word_number,
+                'pronunciations': word,
+                'word_type': '명사',
+                'word_unit': '단어',
+                'definitions': [{'definition': f'{word}의 <sup>{i}</sup> 뜻풀이 {i}', 'examples': [f'{word} 예문']}
+                                for i in range(1, rng.randint(1, 4) + 1)],
+                'related_words': [],
+                'original_language_info': [],
+            })
+    return documents
+
+
+def sampled_dictionary(source_uri: str, word_count: int) -> List[Dict[str, Any]]:
+    source = MongoClient(source_uri)['kkeutmal']['words']
+    return [{key: value for key, value in document.items() if key != '_id'}
+            for document in source.aggregate([{'$sample': {'size': word_count}}])]
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self._message_ids = itertools.count(1000)
+
+    async def send(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return SimpleNamespace(id=next(self._message_ids))
+
+    async def delete_messages(self, messages: List[Any]) -> None:
+        pass
+
+
+class FakeMessage:
+    """
+    The parts of nextcord.Message that WordChainGame uses.
+    """
+
+    def __init__(self, content: str, author_id: int, channel: FakeChannel, message_id: int) -> None:
+        self.id = message_id
+        self.content = content
+        self.author = SimpleNamespace(bot=False, id=author_id, display_name=f'user{author_id}',
+                                      avatar=SimpleNamespace(url='https://cdn.discordapp.com/embed/avatars/0.png'))
+        self.guild = SimpleNamespace(id=BENCH_GUILD_ID)
+        self.channel = channel
+
+
+def next_playable_word(db: DB, guild: Guild) -> Optional[str]:
+    last_char, alternate_char = guild.get_last_character()
+    used_words = guild.used_words()
+    for char in (last_char, alternate_char):
+        if char is None:
+            continue
+        for word in db.lexicon.words_starting_with(char):
+            if word not in used_words:
+                return word
+    return None
+
+
+async def bench_move_path(db: DB, iterations: int) -> Dict[str, Dict[str, float]]:
+    async_db = AsyncDB(db)
+    guilds = GuildCache(async_db)
+    users = UserStatsWriter(async_db)
+    # Without the channel rate limit, which would measure Discord's limits instead of the bot
+    outbox = Outbox(rate=1_000_000, period=1.0)
+    game = WordChainGame(async_db, guilds, users, outbox)
+    channel = FakeChannel(BENCH_CHANNEL_ID)
+
+    guild = await guilds.get(BENCH_GUILD_ID)
+    guild.word_chain_channel = BENCH_CHANNEL_ID
+    guild.initialize_chain(db.find_valid_starting_word(), 0)
+    guilds.update(guild)
+
+    def prepare_accepted(i: int) -> FakeMessage:
+        # A game over restarts the chain inside on_message, so there is always a word to play
+        return FakeMessage(next_playable_word(db, guild) or guild.get_last_word(), 100 + i % 50, channel, i)
+
+    def prepare_rejected(i: int) -> FakeMessage:
+        return FakeMessage(f'{guild.get_last_word()[-1]}없는단어{i}', 100 + i % 50, channel, iterations + i)
+
+    results = {
+        'move_accepted': await measure_async(game.on_message, iterations, prepare_accepted),
+        'move_rejected': await measure_async(game.on_message, iterations, prepare_rejected),
+    }
+    await guilds.close()
+    await users.close()
+    outbox.close()
+    async_db.close()
+    return results
+
+
+def bench_db(db: DB, iterations: int, seed: int) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(seed)
+    words = sorted(db.lexicon.words)
+    sample = [rng.choice(words) for _ in range(iterations)]
+    prefixes = [word[:rng.randint(1, 2)] for word in sample]
+
+    guild = Guild({'server_id': BENCH_GUILD_ID}, [])
+    guild.initialize_chain(db.find_valid_starting_word(), 0)
+    for message_id in range(50):
+        word = next_playable_word(db, guild)
+        if word is None:
+            break
+        guild.add_word(word, message_id)
+    cursor = list(guild.used_words())
+    last_char = guild.get_last_word()[-1]
+
+    def cold_autocomplete(i: int) -> None:
+        db.lexicon.autocomplete_cache.clear()
+        db.autocomplete(prefixes[i])
+
+    results = {
+        'word_exists_hit': measure(lambda i: db.word_exists(sample[i]), iterations),
+        'word_exists_miss': measure(lambda i: db.word_exists(f'{sample[i]}없음'), iterations),
+        'get_definitions_cold': measure(lambda i: db.load_definitions(sample[i]), iterations),
+        'get_definitions_warm': measure(lambda i: db.get_definitions(sample[i]), iterations),
+        'autocomplete_cold': measure(cold_autocomplete, iterations),
+        'autocomplete_warm': measure(lambda i: db.autocomplete(prefixes[i % 20]), iterations),
+        'linkable_words': measure(lambda i: db.linkable_words(last_char, cursor), iterations),
+        'can_play': measure(lambda i: db.can_play(guild), iterations),
+        'find_valid_starting_word': measure(lambda i: db.find_valid_starting_word(), iterations),
+        'get_user': measure(lambda i: db.get_user(1000 + i % 200), iterations),
+    }
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> bool:
+    """
+    Prints the p50/p99 change of every operation and returns False if any got slower than threshold percent.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    print(f"{'operation':<26}{'p50 ms':>20}{'p99 ms':>20}")
+    ok = True
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        columns = []
+        for key in ('p50_ms', 'p99_ms'):
+            change = (result[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+            flag = ' !' if change > threshold else ''
+            ok = ok and change <= threshold
+            columns.append(f'{result[key]:.3f} ({change:+.0f}%){flag}')
+        print(f'{name:<26}{columns[0]:>20}{columns[1]:>20}')
+    return ok
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Benchmarks the database and game hot paths.')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'),
+                            help=f'mongod to run against, the {BENCH_DATABASE} database on it is recreated')
+    arg_parser.add_argument('--in-process', action='store_true', help='use mongomock instead of a mongod')
+    arg_parser.add_argument('--words', type=int, default=20000, help='number of unique words to load')
+    arg_parser.add_argument('--sample-from', help='sample the dictionary from this mongod instead of generating it')
+    arg_parser.add_argument('--lexicon-file', help='benchmark with this compiled lexicon file mapped')
+    arg_parser.add_argument('--iterations', type=int, default=1000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--output', default='bench_results.json')
+    arg_parser.add_argument('--compare', metavar='BASELINE', help='compare --output against an earlier result file')
+    arg_parser.add_argument('--threshold', type=float, default=10.0, help='allowed slowdown in percent')
+    args = arg_parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(args.compare, args.output, args.threshold) else 1)
+
+    if args.in_process:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.mongo_uri)
+
+    client.drop_database(BENCH_DATABASE)
+    documents = (sampled_dictionary(args.sample_from, args.words) if args.sample_from
+                 else synthetic_dictionary(args.words, args.seed))
+    client[BENCH_DATABASE]['words'].insert_many(documents)
+
+    db = DB(client, lexicon_path=args.lexicon_file, database_name=BENCH_DATABASE)
+    print(f'Loaded {len(documents)} documents, {len(db.lexicon)} unique words')
+
+    results = bench_db(db, args.iterations, args.seed)
+    results.update(asyncio.run(bench_move_path(db, args.iterations)))
+    client.drop_database(BENCH_DATABASE)
+
+    for name, result in results.items():
+        print(f"{name:<26} p50 {result['p50_ms']:8.3f}ms  p99 {result['p99_ms']:8.3f}ms  "
+              f"{result['ops_per_sec']:10.0f} ops/sec")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'backend': 'mongomock' if args.in_process else 'mongod',
+            'config': {'words': args.words, 'iterations': args.iterations, 'seed': args.seed,
+                       'sampled': bool(args.sample_from), 'lexicon_file': bool(args.lexicon_file)},
+            'results': results,
+        }, f, indent=2)
+    print(f'Saved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
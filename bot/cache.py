@@ -0,0 +1,250 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, Generic, Hashable, List, Optional, Set, Tuple, TypeVar
+
+from bot.db import AsyncDB
+from bot.leaderboard import Leaderboards
+from bot.logger import get_custom_logger
+from bot.lru import LRUCache
+from bot.model import Guild, User
+
+log = get_custom_logger(__name__)
+
+K = TypeVar('K', bound=Hashable)
+
+
+class WriteBehindCache(ABC, Generic[K]):
+    """
+    Base class for caches that own their objects in memory and persist them in the background.
+    Dirty keys are coalesced and flushed every flush_interval seconds, or sooner once max_dirty keys are pending.
+    """
+
+    def __init__(self, flush_interval: float = 5.0, max_dirty: int = 50) -> None:
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self._dirty: Set[K] = set()
+        self._flush_now = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def mark_dirty(self, key: K) -> None:
+        self._dirty.add(key)
+        if self._task is None and not self._closing:
+            self._task = asyncio.create_task(self._flush_loop())
+        if len(self._dirty) >= self.max_dirty:
+            self._flush_now.set()
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    async def _flush_loop(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        try:
+            await self._write(keys)
+        except Exception as e:
+            # Keep the keys so the next flush retries them
+            self._dirty |= keys
+            log.error(f'{type(self).__name__} failed to flush {len(keys)} entries: {e}')
+
+    @abstractmethod
+    async def _write(self, keys: Set[K]) -> None:
+        ...
+
+    async def close(self) -> None:
+        """
+        Stops the background task and writes everything that is still pending.
+        The task is woken up and awaited rather than cancelled, so a flush in flight either lands
+        or puts its keys back for the final flush.
+        """
+        self._closing = True
+        if self._task is not None:
+            self._flush_now.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class GuildCache(WriteBehindCache[int]):
+    """
+    Resident cache of Guild objects. Reads are served from memory after the first load,
+    and updates are written back to the database in batches.
+    """
+
+    def __init__(self, db: AsyncDB, flush_interval: float = 5.0, max_dirty: int = 50) -> None:
+        super().__init__(flush_interval, max_dirty)
+        self.db = db
+        self._guilds: Dict[int, Guild] = {}
+
+    async def get(self, guild_id: int) -> Guild:
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            loaded = await self.db.get_guild(guild_id)
+            # Another task may have loaded the same guild while we were waiting
+            guild = self._guilds.setdefault(guild_id, loaded)
+        return guild
+
+    def update(self, guild: Guild) -> None:
+        self._guilds[guild.guild_id] = guild
+        self.mark_dirty(guild.guild_id)
+
+    async def _write(self, keys: Set[int]) -> None:
+        # Snapshot on the event loop so the executor thread never sees a half-applied move
+        guilds = [self._guilds[key] for key in keys]
+        changes = [guild.pending_changes() for guild in guilds]
+        await self.db.update_guilds(changes)
+        for guild, change in zip(guilds, changes):
+            guild.mark_persisted(change)
+
+
+class UserStatsWriter(WriteBehindCache[int]):
+    """
+    Buffers per-move user statistics and writes them in periodic bulk writes: one upsert per user
+    and one per (user, word) played in the user_words collection.
+    Recently used User objects are cached and updated immediately, so profiles reflect pending writes,
+    and so are the guild leaderboards. Other bot processes write to the same users, so a cached User is
+    read again once it is older than cache_ttl seconds.
+    """
+
+    def __init__(self, db: AsyncDB, flush_interval: float = 5.0, max_dirty: int = 200, cache_size: int = 1024,
+                 leaderboards: Optional[Leaderboards] = None, cache_ttl: float = 30.0) -> None:
+        super().__init__(flush_interval, max_dirty)
+        self.db = db
+        self.leaderboards = leaderboards
+        self.cache_ttl = cache_ttl
+        # (user, time it was loaded)
+        self._users: LRUCache[int, Tuple[User, float]] = LRUCache(max_size=cache_size)
+        self._pending_words: Dict[int, Counter] = {}
+        self._pending_experience: Dict[int, int] = {}
+        # Experience per guild, keyed by user like the rest of the pending statistics
+        self._pending_guild_experience: Dict[int, Counter] = {}
+        # Words whose total_words increment is already written, waiting to be retried in user_words only
+        self._pending_word_counts_only: Dict[int, Counter] = {}
+        # Users whose increments are being written, and the number of writes started so far
+        self._writing: Counter = Counter()
+        self._writes_started = 0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self._users.hit_rate
+
+    @property
+    def writes_started(self) -> int:
+        return self._writes_started
+
+    @property
+    def writing(self) -> bool:
+        """
+        Whether increments are being written, so that a database read can't tell if it saw them.
+        """
+        return bool(self._writing)
+
+    async def get(self, user_id: int) -> User:
+        entry = self._users.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.cache_ttl:
+            user = entry[0]
+        else:
+            writes_started = self._writes_started
+            settled = not self._writing[user_id]
+            user = await self.db.get_user(user_id)
+            # The database doesn't have the buffered increments yet
+            user.add_words(sum(self._pending_words.get(user_id, {}).values()))
+            user.add_experience(self._pending_experience.get(user_id, 0))
+            # While a write is in flight there is no telling whether the read saw it, so the user isn't cached
+            if settled and not self._writing[user_id] and writes_started == self._writes_started:
+                self._users.put(user_id, (user, time.monotonic()))
+        return user
+
+    def pending_guild_experience(self) -> Dict[Tuple[int, int], int]:
+        """
+        Experience earned in guilds and not written yet, per (guild_id, user_id).
+        """
+        return {(guild_id, user_id): experience for user_id, guilds in self._pending_guild_experience.items()
+                for guild_id, experience in guilds.items()}
+
+    async def favorite_words(self, user_id: int, count: int) -> List[Tuple[str, int]]:
+        """
+        The user's most used words, counting the words not written yet.
+        """
+        pending = self._pending_words.get(user_id, Counter()) + self._pending_word_counts_only.get(user_id, Counter())
+        return await self.db.get_favorite_words(user_id, count, dict(pending) if pending else None)
+
+    def record_move(self, user_id: int, word: str, experience: int, guild_id: Optional[int] = None) -> None:
+        """
+        Records a played word and the experience earned for it, without a database round trip.
+        """
+        self._pending_words.setdefault(user_id, Counter())[word] += 1
+        self._pending_experience[user_id] = self._pending_experience.get(user_id, 0) + experience
+        if guild_id is not None:
+            self._pending_guild_experience.setdefault(user_id, Counter())[guild_id] += experience
+        if self.leaderboards is not None:
+            self.leaderboards.record(guild_id, user_id, experience)
+
+        # A peek, so the hit rate measures profile reads rather than moves
+        entry = self._users.peek(user_id)
+        if entry is not None:
+            entry[0].add_words()
+            entry[0].add_experience(experience)
+        self.mark_dirty(user_id)
+
+    async def _write(self, keys: Set[int]) -> None:
+        self._writes_started += 1
+        self._writing.update(keys)
+        try:
+            await self._write_increments(keys)
+        finally:
+            self._writing.subtract(keys)
+            self._writing += Counter()
+
+    async def _write_increments(self, keys: Set[int]) -> None:
+        words = {key: self._pending_words.pop(key, Counter()) for key in keys}
+        retried_words = {key: self._pending_word_counts_only.pop(key, Counter()) for key in keys}
+        experience = {key: self._pending_experience.pop(key, 0) for key in keys}
+        guild_experience = {key: self._pending_guild_experience.pop(key, Counter()) for key in keys}
+
+        increments = {key: {'total_words': sum(words[key].values()), 'experience': experience[key]} for key in keys}
+
+        try:
+            await self.db.apply_user_increments(increments)
+        except Exception:
+            # Merge back so the retry also includes anything recorded in the meantime
+            for key in keys:
+                self._pending_words.setdefault(key, Counter()).update(words[key])
+                self._pending_word_counts_only.setdefault(key, Counter()).update(retried_words[key])
+                self._pending_experience[key] = self._pending_experience.get(key, 0) + experience[key]
+                self._pending_guild_experience.setdefault(key, Counter()).update(guild_experience[key])
+            raise
+
+        # The counters above are written, so a failure from here on only merges back what wasn't.
+        # total_words is written too, so failed word counts go to their own buffer that doesn't add to it again.
+        word_increments = {(key, word): count for key in keys
+                           for word, count in (words[key] + retried_words[key]).items()}
+        try:
+            await self.db.apply_user_word_increments(word_increments)
+        except Exception:
+            for key in keys:
+                self._pending_word_counts_only.setdefault(key, Counter()).update(words[key] + retried_words[key])
+                self._pending_guild_experience.setdefault(key, Counter()).update(guild_experience[key])
+            raise
+
+        member_increments = {(guild_id, key): amount
+                             for key in keys for guild_id, amount in guild_experience[key].items()}
+        try:
+            await self.db.apply_guild_member_increments(member_increments)
+        except Exception:
+            for key in keys:
+                self._pending_guild_experience.setdefault(key, Counter()).update(guild_experience[key])
+            raise
@@ -1,10 +1,24 @@
 import os
-from typing import Dict, Any, Optional, List
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, Optional, List, Callable, Tuple, TypeVar
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne, ReplaceOne, DeleteMany
+import asyncio
 import re
 
 from bot.model import Word, Guild, User
-from bot.korean import initial_letter
+from bot.lexemes import ensure_lexeme_indexes, lexemes_complete, rebuild_lexemes
+from bot.leaderboard import ranked
+from bot.lexicon import Lexicon
+from bot.lexicon_file import MappedLexicon
+from bot.logger import get_custom_logger
+from bot.lru import LRUCache
+from bot.user_words import ensure_user_word_indexes, favorite_words, increment_operations, migrate_user_words
+
+log = get_custom_logger(__name__)
+
+T = TypeVar('T')
 
 
 def sanitize_input(input_str: str) -> str:
@@ -15,47 +29,114 @@ def sanitize_input(input_str: str) -> str:
 
 
 class DB:
-    def __init__(self, mongo_client_param: Optional[MongoClient] = None) -> None:
+    def __init__(self, mongo_client_param: Optional[MongoClient] = None, definition_cache_size: int = 4096,
+                 lexicon_path: Optional[str] = None, database_name: str = 'kkeutmal') -> None:
         if mongo_client_param is None:
             mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
             self.mongo_client = MongoClient(mongo_uri)
         else:
             self.mongo_client = mongo_client_param
-        self.db = self.mongo_client['kkeutmal']
+        self.db = self.mongo_client[database_name]
         self.words = self.db['words']
+        self.lexemes = self.db['lexemes']
         self.guilds = self.db['servers']
+        self.word_chains = self.db['word_chains']
         self.users = self.db['users']
+        self.user_words = self.db['user_words']
+        self.guild_members = self.db['guild_members']
+        self.metadata = self.db['metadata']
         self._ensure_indexes()
+        self.definition_cache: LRUCache[str, List[Word]] = LRUCache(max_size=definition_cache_size)
+        self.lexicon_path = lexicon_path
+        self.lexicon_file: Optional[MappedLexicon] = None
+        self.lexicon_version = self.dictionary_version()
+        self.lexicon = self.load_lexicon()
 
     def _ensure_indexes(self) -> None:
         """
         Ensures the necessary indexes are created for efficient querying.
         """
         self.words.create_index([('word', 1), ('word_number', 1)], unique=True)
+        ensure_lexeme_indexes(self.lexemes)
         self.guilds.create_index('server_id', unique=True)
+        self.word_chains.create_index([('server_id', 1), ('game_id', 1), ('index', 1)], unique=True)
         self.users.create_index('user_id', unique=True)
-        self.users.create_index([('used_words.word', 1)])
+        if 'used_words.word_1' in self.users.index_information():
+            # Left over from when every word a user played was kept in the user document
+            self.users.drop_index('used_words.word_1')
+        self.users.create_index([('experience', -1)])
+        self.guild_members.create_index([('guild_id', 1), ('user_id', 1)], unique=True)
+        self.guild_members.create_index([('guild_id', 1), ('experience', -1)])
+        ensure_user_word_indexes(self.user_words)
+
+    def load_lexicon(self) -> Lexicon:
+        """
+        Loads every unique word into an in-memory lexicon, from the compiled lexicon file when there is one.
+        Otherwise the words are streamed from the lexemes collection, which has one document per word,
+        or from the words collection if no build of the lexemes has completed yet.
+        """
+        if self.lexicon_path and os.path.exists(self.lexicon_path):
+            try:
+                self.lexicon_file = MappedLexicon(self.lexicon_path)
+                return Lexicon(self.lexicon_file)
+            except ValueError as e:
+                # Written by an older importer, the next import writes it again
+                log.warning('Ignoring the lexicon file: %s', e)
+        self.lexicon_file = None
+        source = self.lexemes if lexemes_complete(self.lexemes) else self.words
+        return Lexicon(doc['word'] for doc in source.find({}, {'_id': 0, 'word': 1}))
+
+    def rebuild_lexemes(self) -> int:
+        """
+        Rebuilds the lexemes collection from the words collection, see parser/migrate_lexemes.py.
+        """
+        return rebuild_lexemes(self.words, self.lexemes)
+
+    def dictionary_version(self) -> Optional[Any]:
+        """
+        Returns the marker the dictionary importer bumps every time it changes the words collection.
+        """
+        result = self.metadata.find_one({'_id': 'words'})
+        return result.get('updated_at') if result else None
+
+    def refresh_lexicon(self) -> bool:
+        """
+        Reloads the lexicon (and with it the starting word pool) if the dictionary changed since it was loaded.
+        Returns True if it was reloaded.
+        """
+        version = self.dictionary_version()
+        if version == self.lexicon_version:
+            return False
+        self.lexicon = self.load_lexicon()
+        self.lexicon_version = version
+        self.definition_cache.clear()
+        return True
 
     def get_user(self, user_id: int) -> User:
-        result: Optional[Dict[str, Any]] = self.users.find_one({'user_id': user_id})
+        """
+        Reads only the user's scalar statistics, the per-word counts are in the user_words collection.
+        """
+        result: Optional[Dict[str, Any]] = self.users.find_one(
+            {'user_id': user_id}, {'_id': 0, 'user_id': 1, 'experience': 1, 'total_words': 1})
         if result:
             return User(result)
         else:
             # Assuming you want to automatically create a user if not found
-            new_user_dict = {'user_id': user_id, 'used_words': {}, 'experience': 0}
-            self.users.insert_one(new_user_dict)
+            new_user_dict = {'user_id': user_id, 'experience': 0, 'total_words': 0}
+            # An upsert, since a buffered write may create the user at the same time
+            self.users.update_one({'user_id': user_id}, {'$setOnInsert': new_user_dict}, upsert=True)
             return User(new_user_dict)
 
     def add_user_word(self, user: User, word: str) -> None:
         self.users.update_one(
             {'user_id': user.user_id},
-            {'$inc': {f'used_words.{word}': 1, 'total_words': 1}},
+            {'$inc': {'total_words': 1}},
             upsert=True
         )
+        self.user_words.update_one({'user_id': user.user_id, 'word': word}, {'$inc': {'count': 1}}, upsert=True)
 
         # Update the local user object as well
-        user.used_words[word] = user.used_words.get(word, 0) + 1
-        user.total_words += 1
+        user.add_words()
 
     def add_user_experience(self, user: User, experience: int) -> None:
         self.users.update_one(
@@ -63,19 +144,77 @@ class DB:
             {'$inc': {'experience': experience}}
         )
         # Update the local user object as well
-        user.experience += experience
+        user.add_experience(experience)
+
+    def apply_user_increments(self, increments: Dict[int, Dict[str, int]]) -> None:
+        """
+        Applies buffered $inc documents, keyed by user id, as one unordered bulk write.
+        Each user gets a single upsert, so users that don't exist yet are created on the way.
+        """
+        if not increments:
+            return
+        operations = [UpdateOne({'user_id': user_id}, {'$inc': inc}, upsert=True)
+                      for user_id, inc in increments.items()]
+        self.users.bulk_write(operations, ordered=False)
+
+    def apply_user_word_increments(self, increments: Dict[Tuple[int, str], int]) -> None:
+        """
+        Adds word counts, keyed by (user_id, word), to the user_words collection.
+        """
+        operations = increment_operations(increments)
+        if operations:
+            self.user_words.bulk_write(operations, ordered=False)
+
+    def apply_guild_member_increments(self, increments: Dict[Tuple[int, int], int]) -> None:
+        """
+        Adds experience earned in a guild, keyed by (guild_id, user_id), to the guild_members collection.
+        """
+        if not increments:
+            return
+        operations = [UpdateOne({'guild_id': guild_id, 'user_id': user_id}, {'$inc': {'experience': experience}},
+                                upsert=True)
+                      for (guild_id, user_id), experience in increments.items()]
+        self.guild_members.bulk_write(operations, ordered=False)
+
+    def load_guild_leaderboards(self, guild_ids: List[int]) -> List[Tuple[int, int, int]]:
+        """
+        Returns the (guild_id, user_id, experience) of every member of the given guilds.
+        """
+        return [(doc['guild_id'], doc['user_id'], doc.get('experience', 0))
+                for doc in self.guild_members.find({'guild_id': {'$in': guild_ids}},
+                                                   {'_id': 0, 'guild_id': 1, 'user_id': 1, 'experience': 1})]
 
-    def get_favorite_words(self, user: User, count: int) -> list[dict]:
+    def global_top(self, count: int) -> List[Tuple[int, int, int]]:
+        """
+        Returns the (rank, user_id, experience) of the count most experienced users, read from the experience index.
+        """
+        return ranked((doc['user_id'], doc.get('experience', 0))
+                      for doc in self.users.find({'experience': {'$gt': 0}}, {'_id': 0, 'user_id': 1, 'experience': 1})
+                      .sort('experience', -1).limit(count))
+
+    def load_experience_histogram(self) -> List[Tuple[int, int]]:
+        """
+        Returns (experience, number of users) for every experience value above zero. Only the experience index is
+        read, and the result has one entry per distinct value rather than per user.
+        """
         pipeline = [
-            {'$match': {'user_id': user.user_id}},
-            {'$project': {'_id': 0, 'words': {'$objectToArray': '$used_words'}}},
-            {'$unwind': '$words'},
-            {'$sort': {'words.v': -1}},
-            {'$limit': count},
-            {'$project': {'word': '$words.k', 'count': '$words.v'}}
+            {'$match': {'experience': {'$gt': 0}}},
+            {'$group': {'_id': '$experience', 'users': {'$sum': 1}}},
         ]
-        result = self.users.aggregate(pipeline)
-        return [{doc['word']: doc['count']} for doc in result]
+        return [(doc['_id'], doc['users']) for doc in self.users.aggregate(pipeline, hint='experience_-1')]
+
+    def get_favorite_words(self, user_id: int, count: int,
+                           pending: Optional[Dict[str, int]] = None) -> List[Tuple[str, int]]:
+        """
+        Returns the (word, count) of the user's most used words, including the pending counts not written yet.
+        """
+        return favorite_words(self.user_words, user_id, count, pending)
+
+    def migrate_user_words(self) -> int:
+        """
+        Moves legacy used_words maps out of the user documents, see db_data/migrate_user_words.py.
+        """
+        return migrate_user_words(self.users, self.user_words)
 
     def add_guild(self, server_id: int) -> None:
         self.guilds.insert_one({'server_id': server_id})
@@ -83,52 +222,63 @@ class DB:
     def get_guild(self, server_id: int) -> Guild:
         result: Optional[Dict[str, Any]] = self.guilds.find_one({'server_id': server_id})
         if result:
-            return Guild(result)
+            if 'word_chain' in result:
+                # Legacy document with an embedded chain, it is moved out on the next update
+                return Guild(result)
+            entries = self.word_chains.find({'server_id': server_id, 'game_id': result.get('game_id', 0)},
+                                            {'_id': 0, 'word': 1, 'message_id': 1}).sort('index', 1)
+            return Guild(result, list(entries))
         else:
             self.add_guild(server_id)
-            return Guild({'server_id': server_id})
+            return Guild({'server_id': server_id}, [])
 
     def update_guild(self, guild: Guild) -> None:
-        self.guilds.update_one({'server_id': guild.guild_id}, {'$set': guild.to_dict()})
+        changes = guild.pending_changes()
+        self.update_guilds([changes])
+        guild.mark_persisted(changes)
 
-    def autocomplete(self, prefix: str) -> List[str]:
+    def update_guilds(self, changes: List[Dict[str, Any]]) -> None:
         """
-        Returns up to 15 unique words matching the prefix pattern.
+        Writes the pending changes of several guilds (see Guild.pending_changes).
+        Chain entries are appended to the word_chains collection instead of growing the guild document,
+        and are keyed by their position so a retried write is idempotent.
         """
-        regex_pattern = f'^{sanitize_input(prefix)}'
+        if not changes:
+            return
+        guild_operations = []
+        chain_operations = []
+        for change in changes:
+            document = change['document']
+            guild_operations.append(UpdateOne({'server_id': document['server_id']},
+                                              {'$set': document, '$unset': {'word_chain': ''}}, upsert=True))
+            if change['reset']:
+                chain_operations.append(DeleteMany({'server_id': document['server_id'],
+                                                    'game_id': {'$ne': change['game_id']}}))
+            for entry in change['entries']:
+                key = {'server_id': entry['server_id'], 'game_id': entry['game_id'], 'index': entry['index']}
+                chain_operations.append(ReplaceOne(key, entry, upsert=True))
 
-        pipeline = [
-            {'$match': {'word': {'$regex': regex_pattern}}},
-            {'$group': {'_id': '$word'}},
-            {'$sort': {'_id': 1}},
-            {'$limit': 15}
-        ]
+        if chain_operations:
+            self.word_chains.bulk_write(chain_operations, ordered=False)
+        self.guilds.bulk_write(guild_operations, ordered=False)
 
-        results = self.words.aggregate(pipeline)
-
-        return [doc['_id'] for doc in results]
+    def autocomplete(self, prefix: str) -> List[str]:
+        """
+        Returns up to 15 unique words matching the prefix pattern, served from the in-memory lexicon.
+        """
+        return self.lexicon.autocomplete(prefix)
 
-    def linkable_words(self, link_char: str, cursor: str) -> List[str]:
+    def linkable_words(self, link_char: str, cursor: List[str]) -> List[str]:
         """
         Returns all words that start with the link_char and are not in the cursor list.
         """
-
-        pipeline = [
-            {'$match': {'word': {'$nin': cursor}}},
-            {'$group': {'_id': '$word'}},
-            {'$sort': {'_id': 1}},
-            {'$match': {'_id': {'$regex': f'^{sanitize_input(link_char)}'}}},
-        ]
-
-        results = self.words.aggregate(pipeline)
-        return [doc['_id'] for doc in results]
+        return sorted(self.lexicon.words_starting_with(link_char) - set(cursor))
 
     def word_exists(self, word: str) -> bool:
         """
-        Fastest way to check the membership of a word in the collection.
+        Fastest way to check the membership of a word: a set lookup in the in-memory lexicon, no database round trip.
         """
-        count = self.words.count_documents({'word': word})
-        return count > 0
+        return word in self.lexicon
 
     def get_word(self, word: str) -> Dict[str, Any]:
         """
@@ -136,30 +286,12 @@ class DB:
         """
         return self.words.find_one({'word': word})
 
-    def random_word(self) -> str:
-        """
-        Returns a random word from the collection.
-        """
-        pipeline = [
-            {'$sample': {'size': 1}}
-        ]
-
-        results = self.words.aggregate(pipeline)
-        return next(results)['word']
-
     def find_valid_starting_word(self) -> str:
         """
-        Finds a valid starting word for the game that is longer than 2 characters
-        and has at least 5 linkable words.
+        Picks a valid starting word for the game that is longer than 2 characters
+        and has at least 3 linkable words, from the pool precomputed by the lexicon.
         """
-        word = self.random_word()
-
-        # Check if the word meets the criteria: longer than 2 chars and has at least 3 linkable words
-        if len(word) > 2 and len(self.autocomplete(word)) >= 3:
-            return word
-        else:
-            # Recursively try another word if the criteria are not met
-            return self.find_valid_starting_word()
+        return self.lexicon.random_starting_word()
 
     def can_play(self, guild: Guild) -> bool:
         if not guild.word_chain:
@@ -168,25 +300,180 @@ class DB:
         if not last_word:
             return False
 
-        def try_play(chain_char, excluded_words):
-            linkable_words = self.linkable_words(chain_char, excluded_words)
+        return self.lexicon.can_continue(last_word[-1], guild.used_by_first_char)
 
-            if linkable_words:
-                return True  # If there are linkable words, the game can still be played.
-            # Check with initial letter law (두음 법칙)
-            alternate_char = initial_letter(chain_char)
-            if alternate_char:
-                linkable_words_alt = self.linkable_words(alternate_char, excluded_words)
-                if linkable_words_alt:
-                    return True  # Found playable words with alternate initial letter.
-            return False  # No playable words found, game over.
-        return try_play(last_word[-1], [word_dict['word'] for word_dict in guild.word_chain])
+    def remaining_moves(self, guild: Guild) -> int:
+        """
+        Number of unused words that can still follow the guild's last word.
+        """
+        if not guild.word_chain:
+            return 0
+        return self.lexicon.remaining_moves(guild.get_last_word()[-1], guild.used_by_first_char)
 
     def get_definitions(self, word: str) -> List[Word]:
         """
         Retrieves definitions of a word from the database and returns a list of Word objects.
         If no definitions are found, returns an empty list.
         This version assumes case-sensitive exact matches for efficiency.
+        Parsed words are kept in a size-bounded LRU cache together with their rendered embed text.
+        """
+        definitions = self.definition_cache.get(word)
+        if definitions is None:
+            definitions = self.load_definitions(word)
+        return definitions
+
+    def get_definitions_many(self, words: List[str]) -> Dict[str, List[Word]]:
+        """
+        Retrieves the definitions of several words, querying every word missing from the cache in one $in query.
+        """
+        results = {}
+        missing = []
+        for word in words:
+            definitions = self.definition_cache.get(word)
+            if definitions is None:
+                missing.append(word)
+            else:
+                results[word] = definitions
+        if missing:
+            results.update(self.load_definitions_many(missing))
+        return results
+
+    def load_definitions_many(self, words: List[str]) -> Dict[str, List[Word]]:
+        results: Dict[str, List[Word]] = {word: [] for word in words}
+        for doc in self.words.find({'word': {'$in': words}}):
+            results[doc['word']].append(Word(doc))
+        for word, definitions in results.items():
+            self.definition_cache.put(word, definitions)
+        return results
+
+    def load_definitions(self, word: str) -> List[Word]:
         """
-        documents = self.words.find({'word': word})
-        return [Word(doc) for doc in documents]
+        Queries the definitions of a word, bypassing the cache lookup, and stores them in the cache.
+        """
+        if self.lexicon_file is not None:
+            # The lexicon file points straight at the documents, and unknown words need no query at all
+            pointers = [ObjectId(pointer) for pointer in self.lexicon_file.definition_pointers(word)]
+            # Sorted like the (word, word_number) index walk, so the first definition is the same on every path
+            documents = self.words.find({'_id': {'$in': pointers}}).sort('word_number', 1) if pointers else []
+        else:
+            documents = self.words.find({'word': word})
+        definitions = [Word(doc) for doc in documents]
+        self.definition_cache.put(word, definitions)
+        return definitions
+
+
+class AsyncDB:
+    """
+    Awaitable facade over DB for use on the bot's event loop.
+    Queries run on a bounded thread pool, and callers wait on a semaphore once too many are queued,
+    so a slow query never stalls gateway heartbeats or other guilds.
+    """
+
+    def __init__(self, db: Optional[DB] = None, max_workers: int = 8, max_pending: int = 64) -> None:
+        self.db = db if db is not None else DB()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self._pending = asyncio.Semaphore(max_pending)
+        self.in_flight = 0
+
+    @property
+    def lexicon(self) -> Lexicon:
+        return self.db.lexicon
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        self.in_flight += 1
+        try:
+            async with self._pending:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, partial(func, *args))
+        finally:
+            self.in_flight -= 1
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.db.mongo_client.close()
+
+    async def get_user(self, user_id: int) -> User:
+        return await self._run(self.db.get_user, user_id)
+
+    async def add_user_word(self, user: User, word: str) -> None:
+        await self._run(self.db.add_user_word, user, word)
+
+    async def add_user_experience(self, user: User, experience: int) -> None:
+        await self._run(self.db.add_user_experience, user, experience)
+
+    async def apply_user_increments(self, increments: Dict[int, Dict[str, int]]) -> None:
+        await self._run(self.db.apply_user_increments, increments)
+
+    async def apply_user_word_increments(self, increments: Dict[Tuple[int, str], int]) -> None:
+        await self._run(self.db.apply_user_word_increments, increments)
+
+    async def apply_guild_member_increments(self, increments: Dict[Tuple[int, int], int]) -> None:
+        await self._run(self.db.apply_guild_member_increments, increments)
+
+    async def load_guild_leaderboards(self, guild_ids: List[int]) -> List[Tuple[int, int, int]]:
+        return await self._run(self.db.load_guild_leaderboards, guild_ids)
+
+    async def global_top(self, count: int) -> List[Tuple[int, int, int]]:
+        return await self._run(self.db.global_top, count)
+
+    async def load_experience_histogram(self) -> List[Tuple[int, int]]:
+        return await self._run(self.db.load_experience_histogram)
+
+    async def get_favorite_words(self, user_id: int, count: int,
+                                 pending: Optional[Dict[str, int]] = None) -> List[Tuple[str, int]]:
+        return await self._run(self.db.get_favorite_words, user_id, count, pending)
+
+    async def get_guild(self, server_id: int) -> Guild:
+        return await self._run(self.db.get_guild, server_id)
+
+    async def update_guild(self, guild: Guild) -> None:
+        await self._run(self.db.update_guild, guild)
+
+    async def update_guilds(self, changes: List[Dict[str, Any]]) -> None:
+        await self._run(self.db.update_guilds, changes)
+
+    def autocomplete(self, prefix: str) -> List[str]:
+        return self.db.autocomplete(prefix)
+
+    def word_exists(self, word: str) -> bool:
+        return self.db.word_exists(word)
+
+    async def get_word(self, word: str) -> Dict[str, Any]:
+        return await self._run(self.db.get_word, word)
+
+    async def refresh_lexicon(self) -> bool:
+        return await self._run(self.db.refresh_lexicon)
+
+    def find_valid_starting_word(self) -> str:
+        return self.db.find_valid_starting_word()
+
+    async def get_definitions(self, word: str) -> List[Word]:
+        definitions = self.db.definition_cache.get(word)
+        if definitions is None:
+            definitions = await self._run(self.db.load_definitions, word)
+        return definitions
+
+    async def get_definitions_many(self, words: List[str]) -> Dict[str, List[Word]]:
+        results = {}
+        missing = []
+        for word in words:
+            definitions = self.db.definition_cache.get(word)
+            if definitions is None:
+                missing.append(word)
+            else:
+                results[word] = definitions
+        if missing:
+            results.update(await self._run(self.db.load_definitions_many, missing))
+        return results
+
+    def linkable_words(self, link_char: str, cursor: List[str]) -> List[str]:
+        return self.db.linkable_words(link_char, cursor)
+
+    def can_play(self, guild: Guild) -> bool:
+        """
+        Served from the in-memory lexicon, so it is cheap enough to call directly on the event loop.
+        """
+        return self.db.can_play(guild)
+
+    def remaining_moves(self, guild: Guild) -> int:
+        return self.db.remaining_moves(guild)
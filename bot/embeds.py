@@ -1,8 +1,5 @@
 import nextcord
 from bot.model import Word
-import re
-
-pattern = r'<[^>]+>.*?</[^>]+>'
 
 
 class SimpleEmbed:
@@ -29,10 +26,4 @@ class SimpleEmbed:
 
     @staticmethod
     def format_def(word: Word, prefix: str = '') -> str:
-        def_text = ''
-        for i, definition_info in enumerate(word.definitions):
-            definition = definition_info['definition']
-            definition = re.sub(pattern, '', definition)
-            def_text += f'{prefix}`「{i + 1}」` {definition}\n'
-
-        return def_text
+        return word.format_definitions(prefix)
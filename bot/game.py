@@ -0,0 +1,111 @@
+import asyncio
+from typing import Dict, Optional
+
+import nextcord
+
+from bot.cache import GuildCache, UserStatsWriter
+from bot.db import AsyncDB
+from bot.embeds import SimpleEmbed
+from bot.korean import eh_or_ehro, word_with_initial, el_or_rel
+from bot.model import Guild
+from bot.outbox import Outbox
+
+embed = SimpleEmbed()
+
+
+class WordChainGame:
+    """
+    Plays the moves sent to word chain channels. It only talks to Discord through the message it is given
+    and the outbox, so it can also be driven without a gateway connection, e.g. by the benchmarks.
+    """
+
+    def __init__(self, db: AsyncDB, guilds: GuildCache, users: UserStatsWriter,
+                 outbox: Optional[Outbox] = None) -> None:
+        self.db = db
+        self.guilds = guilds
+        self.users = users
+        self.outbox = outbox if outbox is not None else Outbox()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def guild_lock(self, guild_id: int) -> asyncio.Lock:
+        """
+        Held while a guild's chain is changed, by moves as well as by commands that restart the game.
+        """
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    async def on_message(self, message: nextcord.Message) -> None:
+        if message.author.bot:
+            return
+
+        if message.content.startswith('> '):
+            return
+
+        guild_data = await self.guilds.get(message.guild.id)
+        if guild_data.word_chain_channel_id() == message.channel.id:
+            self.outbox.delete(message)
+            # Moves of one guild are played one at a time so that two players can't extend the same chain,
+            # moves of different guilds don't wait for each other
+            async with self.guild_lock(guild_data.guild_id):
+                rejection = await self._play(message, guild_data)
+            if rejection is not None:
+                self.outbox.notify(message.channel, rejection)
+
+    async def _play(self, message: nextcord.Message, guild_data: Guild) -> Optional[nextcord.Embed]:
+        """
+        Plays the message as the next word of the guild's chain, or returns the embed explaining why it can't be.
+        """
+        message_content = message.content.strip()
+
+        if len(message_content) < 2:
+            return embed.error(f'2글자 이상의 단어를 입력해주세요.', footer='팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!')
+
+        if not guild_data.word_chain:
+            return embed.error('진행 중인 게임이 없습니다. `/재시작`으로 새 게임을 시작해주세요.')
+
+        last_char, altnative_char = guild_data.get_last_character()
+
+        if message_content[0] != last_char and message_content[0] != altnative_char:
+            linkable_char = guild_data.get_linkable_char_str()
+            return embed.error(
+                text=f'단어의 첫 글자가 일치하지 않습니다.\n"**{linkable_char}**"{eh_or_ehro(last_char[0])} 시작하는 단어를 입력해주세요.',
+                footer=f'팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!')
+
+        if guild_data.is_word_in_chain(message_content):
+            return embed.error(f'이미 [여기서]({guild_data.get_word_message_url(message_content)}) 사용된 단어입니다.')
+
+        if not self.db.word_exists(message_content):
+            return embed.error(f'존재하지 않는 단어입니다.', footer='팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!')
+
+        prev_word = guild_data.get_last_word()
+        next_word = (await self.db.get_definitions(message_content))[0]
+
+        next_embed = nextcord.Embed(title=f'{word_with_initial(prev_word)} → {word_with_initial(message_content)}',
+                                    description=next_word.description_text, color=0x2B2D31)
+        next_embed.add_field(name=f'뜻풀이', value=SimpleEmbed.format_def(next_word), inline=False)
+        next_embed.set_author(name=message.author.display_name, icon_url=message.author.avatar.url)
+        next_embed.set_footer(text=f'콤보: {len(guild_data.word_chain)} | 최고 콤보: {guild_data.best_combo}')
+        next_message = await self.outbox.send(message.channel, embed=next_embed)
+
+        guild_data.add_word(message_content, next_message.id)
+        self.guilds.update(guild_data)
+
+        # Determine if the game is over
+        if not self.db.can_play(guild_data):
+            game_over_embed = nextcord.Embed(title='게임 오버!',
+                                             description=f'더이상 "**{word_with_initial(message_content)}**"'
+                                                         f'{el_or_rel(message_content[-1])} 이을 수 있는 단어가 없습니다!',
+                                             color=0xE74C3B)
+            game_over_embed.set_footer(text=f'최종 콤보: {len(guild_data.word_chain)}')
+            await self.outbox.send(message.channel, embed=game_over_embed)
+
+            start_word = self.db.find_valid_starting_word()
+            start_definition = (await self.db.get_definitions(start_word))[0]
+            start_msg = await self.outbox.send(message.channel, embed=embed.game_start(start_definition))
+            guild_data.initialize_chain(start_word, start_msg.id)
+            self.guilds.update(guild_data)
+
+        self.users.record_move(message.author.id, message_content, len(message_content) ** 2, guild_data.guild_id)
+        return None
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 
 CHOSUNG_LIST = ['ㄱ', 'ㄲ', 'ㄴ', 'ㄷ', 'ㄸ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅃ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅉ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
 JUNGSUNG_LIST = ['ㅏ', 'ㅐ', 'ㅑ', 'ㅒ', 'ㅓ', 'ㅔ', 'ㅕ', 'ㅖ', 'ㅗ', 'ㅘ', 'ㅙ', 'ㅚ', 'ㅛ', 'ㅜ', 'ㅝ', 'ㅞ', 'ㅟ', 'ㅠ', 'ㅡ', 'ㅢ',
@@ -6,55 +6,124 @@ JUNGSUNG_LIST = ['ㅏ', 'ㅐ', 'ㅑ', 'ㅒ', 'ㅓ', 'ㅔ', 'ㅕ', 'ㅖ', 'ㅗ',
 JONGSUNG_LIST = [' ', 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ', 'ㅁ', 'ㅂ', 'ㅄ', 'ㅅ',
                  'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
 
+# Compound jamo split into the keys typed to produce them, so a half-typed syllable still matches
+COMPOUND_JAMO = {
+    'ㅘ': 'ㅗㅏ', 'ㅙ': 'ㅗㅐ', 'ㅚ': 'ㅗㅣ', 'ㅝ': 'ㅜㅓ', 'ㅞ': 'ㅜㅔ', 'ㅟ': 'ㅜㅣ', 'ㅢ': 'ㅡㅣ',
+    'ㄳ': 'ㄱㅅ', 'ㄵ': 'ㄴㅈ', 'ㄶ': 'ㄴㅎ', 'ㄺ': 'ㄹㄱ', 'ㄻ': 'ㄹㅁ', 'ㄼ': 'ㄹㅂ', 'ㄽ': 'ㄹㅅ', 'ㄾ': 'ㄹㅌ',
+    'ㄿ': 'ㄹㅍ', 'ㅀ': 'ㄹㅎ', 'ㅄ': 'ㅂㅅ'
+}
 
-def decompose_korean_char(korean_char: str) -> list[str]:
-    ch1 = (ord(korean_char) - ord('가')) // 588
-    ch2 = ((ord(korean_char) - ord('가')) - (588 * ch1)) // 28
-    ch3 = (ord(korean_char) - ord('가')) - (588 * ch1) - 28 * ch2
+HANGUL_BASE = ord('가')
+HANGUL_COUNT = len(CHOSUNG_LIST) * len(JUNGSUNG_LIST) * len(JONGSUNG_LIST)  # 11,172 syllables
 
-    return [CHOSUNG_LIST[ch1], JUNGSUNG_LIST[ch2], JONGSUNG_LIST[ch3]]
+_CHOSUNG_INDEX = {jamo: i for i, jamo in enumerate(CHOSUNG_LIST)}
+_JUNGSUNG_INDEX = {jamo: i for i, jamo in enumerate(JUNGSUNG_LIST)}
+_JONGSUNG_INDEX = {jamo: i for i, jamo in enumerate(JONGSUNG_LIST)}
+
+# Vowels that drop or soften an initial ㄴ/ㄹ under the initial letter law (두음 법칙)
+_Y_VOWELS = {'ㅣ', 'ㅑ', 'ㅕ', 'ㅛ', 'ㅠ', 'ㅖ', 'ㅒ'}
+_PLAIN_VOWELS = {'ㅏ', 'ㅗ', 'ㅜ', 'ㅡ'}
+
+
+def _syllable_index(char: str) -> Optional[int]:
+    if len(char) != 1:
+        return None
+    index = ord(char) - HANGUL_BASE
+    return index if 0 <= index < HANGUL_COUNT else None
+
+
+def _build_tables() -> Tuple[list, list, list, list, dict]:
+    """
+    Precomputes everything derived from a single syllable, indexed by its offset from '가'.
+    """
+    decomposed, initial_letters, eh_or_ehro_table, el_or_rel_table = [], [], [], []
+    jamo_table = {ord(jamo): keys for jamo, keys in COMPOUND_JAMO.items()}
+
+    for index in range(HANGUL_COUNT):
+        chosung = CHOSUNG_LIST[index // 588]
+        jungsung = JUNGSUNG_LIST[(index % 588) // 28]
+        jongsung = JONGSUNG_LIST[index % 28]
+        decomposed.append((chosung, jungsung, jongsung))
+
+        alternate = chosung
+        if chosung in ('ㄴ', 'ㄹ') and jungsung in _Y_VOWELS:
+            alternate = 'ㅇ'
+        elif chosung == 'ㄹ' and jungsung in _PLAIN_VOWELS:
+            alternate = 'ㄴ'
+        initial_letters.append(compose_korean_char(alternate, jungsung, jongsung) if alternate != chosung else None)
+
+        eh_or_ehro_table.append('로' if jongsung in ('ㄹ', ' ') else '으로')
+        el_or_rel_table.append('를' if jongsung == ' ' else '을')
+
+        jamo_table[HANGUL_BASE + index] = ''.join(COMPOUND_JAMO.get(jamo, jamo)
+                                                  for jamo in (chosung, jungsung, jongsung) if jamo != ' ')
+
+    return decomposed, initial_letters, eh_or_ehro_table, el_or_rel_table, jamo_table
+
+
+def is_hangul_syllable(char: str) -> bool:
+    return _syllable_index(char) is not None
+
+
+def decompose_korean_char(korean_char: str) -> Optional[list[str]]:
+    """
+    :return: [chosung, jungsung, jongsung] (' ' when there is no jongsung), or None if the input isn't a syllable
+    """
+    index = _syllable_index(korean_char)
+    return list(_DECOMPOSED[index]) if index is not None else None
 
 
 def compose_korean_char(chosung: str, jungsung: str, jongsung: str) -> str:
-    ch1 = CHOSUNG_LIST.index(chosung)
-    ch2 = JUNGSUNG_LIST.index(jungsung)
-    ch3 = JONGSUNG_LIST.index(jongsung)
+    ch1 = _CHOSUNG_INDEX[chosung]
+    ch2 = _JUNGSUNG_INDEX[jungsung]
+    ch3 = _JONGSUNG_INDEX[jongsung]
 
-    return chr(ord('가') + 588 * ch1 + 28 * ch2 + ch3)
+    return chr(HANGUL_BASE + 588 * ch1 + 28 * ch2 + ch3)
 
 
-def initial_letter(korean_char: str) -> Optional[str]:
-    decomposed = decompose_korean_char(korean_char)
+def to_jamo(text: str) -> str:
+    """
+    Decomposes every Hangul syllable in text into the jamo keystrokes that produce it, e.g. '사과' -> 'ㅅㅏㄱㅗㅏ'.
+    Characters that are not Hangul are kept as they are.
+    """
+    return text.translate(_JAMO_TABLE)
 
-    if decomposed[0] in ['ㄴ', 'ㄹ'] and decomposed[1] in ['ㅣ', 'ㅑ', 'ㅕ', 'ㅛ', 'ㅠ', 'ㅖ', 'ㅒ']:
-        decomposed[0] = 'ㅇ'
-    elif decomposed[0] == 'ㄹ' and decomposed[1] in ['ㅣ', 'ㅑ', 'ㅕ', 'ㅛ', 'ㅠ', 'ㅖ', 'ㅒ']:
-        decomposed[0] = 'ㄴ'
-    elif decomposed[0] == 'ㄹ' and decomposed[1] in ['ㅏ', 'ㅗ', 'ㅜ', 'ㅡ']:
-        decomposed[0] = 'ㄴ'
-    result = compose_korean_char(decomposed[0], decomposed[1], decomposed[2])
 
-    return None if result == korean_char else result
+def initial_letter(korean_char: str) -> Optional[str]:
+    """
+    :return: The syllable korean_char turns into at the start of a word (두음 법칙), or None if it stays the same
+    """
+    index = _syllable_index(korean_char)
+    return _INITIAL_LETTERS[index] if index is not None else None
 
 
 def eh_or_ehro(korean_char: str) -> str:
-    decomposed = decompose_korean_char(korean_char)
-    if decomposed[2] == 'ㄹ' or decomposed[2] == ' ':
-        return '로'
-    else:
-        return '으로'
+    index = _syllable_index(korean_char)
+    return _EH_OR_EHRO[index] if index is not None else '(으)로'
 
 
 def el_or_rel(korean_char: str) -> str:
-    decomposed = decompose_korean_char(korean_char)
-    if decomposed[2] == ' ':
-        return '를'
-    else:
-        return '을'
+    index = _syllable_index(korean_char)
+    return _EL_OR_REL[index] if index is not None else '을(를)'
 
 
 def word_with_initial(word: str) -> str:
-    last_char = word[-1]
-    if initial_letter(last_char):
-        return f'{word}({initial_letter(last_char)})'
+    alternate_char = initial_letter(word[-1]) if word else None
+    if alternate_char:
+        return f'{word}({alternate_char})'
     return word
+
+
+def initial_letters(chars: Iterable[str]) -> List[Optional[str]]:
+    return [initial_letter(char) for char in chars]
+
+
+def to_jamo_many(words: Iterable[str]) -> List[str]:
+    return [word.translate(_JAMO_TABLE) for word in words]
+
+
+def words_with_initial(words: Iterable[str]) -> List[str]:
+    return [word_with_initial(word) for word in words]
+
+
+_DECOMPOSED, _INITIAL_LETTERS, _EH_OR_EHRO, _EL_OR_REL, _JAMO_TABLE = _build_tables()
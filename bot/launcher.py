@@ -0,0 +1,152 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+from bot.logger import get_custom_logger
+from bot.metrics import DEFAULT_PORT
+
+log = get_custom_logger(__name__)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DISCORD_API = 'https://discord.com/api/v10'
+
+
+def recommended_shard_count(token: str) -> int:
+    request = urllib.request.Request(f'{DISCORD_API}/gateway/bot', headers={'Authorization': f'Bot {token}'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """
+    Splits the shard ids into contiguous ranges that differ in size by at most one.
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class ShardProcess:
+    """
+    One main.py process that runs a range of shards and serves /health on its own metrics port.
+    """
+
+    def __init__(self, shard_ids: List[int], shard_count: int, metrics_port: int) -> None:
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.metrics_port = metrics_port
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    @property
+    def name(self) -> str:
+        return f'shards {self.shard_ids[0]}-{self.shard_ids[-1]}'
+
+    def start(self) -> None:
+        env = dict(os.environ, KKEUTMAL_SHARD_IDS=','.join(map(str, self.shard_ids)),
+                   KKEUTMAL_SHARD_COUNT=str(self.shard_count), KKEUTMAL_METRICS_PORT=str(self.metrics_port))
+        self.started_at = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, os.path.join(BOT_DIR, 'main.py')], cwd=BOT_DIR, env=env)
+        log.info(f'Started {self.name} (pid {self.process.pid}, metrics port {self.metrics_port})')
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def is_healthy(self) -> bool:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.metrics_port}/health', timeout=2) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def wait_until_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.is_running():
+                return False
+            if self.is_healthy():
+                return True
+            time.sleep(1)
+        return False
+
+    def stop(self) -> None:
+        if self.is_running():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class Launcher:
+    """
+    Runs the bot as several processes, each owning a contiguous range of shards and the state of their guilds.
+    Processes are started one at a time and each must report ready before the next one identifies,
+    which keeps the processes from tripping Discord's identify rate limit together.
+    Processes that exit are started again.
+    """
+
+    def __init__(self, config: Dict) -> None:
+        shard_count = config.get('shard_count') or recommended_shard_count(config['token'])
+        processes = config.get('processes') or os.cpu_count() or 1
+        base_port = config.get('metrics_port') or DEFAULT_PORT
+        self.startup_timeout = config.get('shard_startup_timeout', 300)
+        self.check_interval = config.get('shard_check_interval', 10)
+        self.shards = [ShardProcess(shard_ids, shard_count, base_port + i)
+                       for i, shard_ids in enumerate(split_shards(shard_count, processes))]
+        self._stopping = False
+        log.info(f'Running {shard_count} shards in {len(self.shards)} processes')
+
+    def start_shard(self, shard: ShardProcess) -> None:
+        shard.start()
+        if not shard.wait_until_ready(self.startup_timeout):
+            log.error(f'{shard.name} did not become ready within {self.startup_timeout}s')
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for shard in self.shards:
+            if self._stopping:
+                break
+            self.start_shard(shard)
+
+        while not self._stopping:
+            time.sleep(self.check_interval)
+            for shard in self.shards:
+                if self._stopping:
+                    break
+                if not shard.is_running():
+                    if time.monotonic() - shard.started_at > 600:
+                        shard.restarts = 0
+                    shard.restarts += 1
+                    log.error(f'{shard.name} exited with code {shard.process.returncode}, '
+                              f'restarting ({shard.restarts} restarts)')
+                    # Back off a little when a process keeps dying, e.g. on a bad token or an unreachable database
+                    time.sleep(min(60, 2 ** min(shard.restarts, 6)))
+                    self.start_shard(shard)
+                elif not shard.is_healthy():
+                    log.warning(f'{shard.name} is running but not ready')
+
+        for shard in self.shards:
+            shard.stop()
+        log.info('All shards stopped')
+
+    def stop(self, *_) -> None:
+        self._stopping = True
+
+
+if __name__ == '__main__':
+    with open(os.path.join(BOT_DIR, 'config.json'), 'r') as file:
+        Launcher(json.load(file)).run()
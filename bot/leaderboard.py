@@ -0,0 +1,113 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+
+def ranked(scores: Iterable[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    (rank, user_id, score) of (user_id, score) pairs ordered from the highest score. Equal scores share a rank.
+    """
+    results = []
+    for index, (user_id, score) in enumerate(scores):
+        rank = results[-1][0] if results and results[-1][2] == score else index + 1
+        results.append((rank, user_id, score))
+    return results
+
+
+class Leaderboard:
+    """
+    Scores kept sorted in memory, so the top entries and anyone's rank are read without scanning every user.
+    Entries are (-score, user_id) tuples, which sorts the highest score first and breaks ties by user id.
+    """
+
+    def __init__(self, scores: Iterable[Tuple[int, int]] = ()) -> None:
+        self._scores: Dict[int, int] = {}
+        for user_id, score in scores:
+            self._scores[user_id] = self._scores.get(user_id, 0) + score
+        self._order: List[Tuple[int, int]] = sorted((-score, user_id) for user_id, score in self._scores.items())
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def add(self, user_id: int, points: int) -> None:
+        old_score = self._scores.get(user_id)
+        if old_score is not None:
+            del self._order[bisect_left(self._order, (-old_score, user_id))]
+        score = (old_score or 0) + points
+        self._scores[user_id] = score
+        insort(self._order, (-score, user_id))
+
+    def score(self, user_id: int) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """
+        1-based rank of the user, shared by everyone with the same score. None if the user has no score.
+        """
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._order, (-score,)) + 1
+
+    def top(self, count: int) -> List[Tuple[int, int, int]]:
+        """
+        (rank, user_id, score) of the count highest scores.
+        """
+        return ranked((user_id, -negative_score) for negative_score, user_id in self._order[:count])
+
+
+class ExperienceHistogram:
+    """
+    How many users have each experience value, rebuilt periodically from the database. A user's global rank is one
+    more than the number of users with more experience, a bisect over the distinct values.
+    """
+
+    def __init__(self, counts: Iterable[Tuple[int, int]] = ()) -> None:
+        # (experience, users) from the highest experience, with the experience negated for bisect
+        self._negated_scores: List[int] = []
+        self._users_above: List[int] = []
+        self.total = 0
+        for experience, users in sorted(counts, reverse=True):
+            self._negated_scores.append(-experience)
+            self._users_above.append(self.total)
+            self.total += users
+
+    def rank(self, experience: int) -> int:
+        index = bisect_left(self._negated_scores, -experience)
+        return (self._users_above[index] if index < len(self._users_above) else self.total) + 1
+
+
+class Leaderboards:
+    """
+    One experience leaderboard per guild this process serves, counting the experience earned in that guild.
+    Moves are recorded as they are played, and load() rebuilds the boards from the database.
+    The global ranking spans the players of every process: its top entries are read from the users experience
+    index, and anyone's rank comes from an ExperienceHistogram refreshed with the guild boards.
+    """
+
+    def __init__(self) -> None:
+        self.guild_boards: Dict[int, Leaderboard] = {}
+        self.global_histogram = ExperienceHistogram()
+
+    def load(self, member_scores: Iterable[Tuple[int, int, int]],
+             pending_members: Optional[Mapping[Tuple[int, int], int]] = None) -> None:
+        """
+        Replaces the boards with the scores read from the database, plus the increments not written there yet.
+        member_scores are (guild_id, user_id, experience) tuples.
+        """
+        members: Dict[int, List[Tuple[int, int]]] = {}
+        for guild_id, user_id, score in member_scores:
+            members.setdefault(guild_id, []).append((user_id, score))
+        for (guild_id, user_id), score in (pending_members or {}).items():
+            members.setdefault(guild_id, []).append((user_id, score))
+        self.guild_boards = {guild_id: Leaderboard(scores) for guild_id, scores in members.items()}
+
+    def record(self, guild_id: Optional[int], user_id: int, experience: int) -> None:
+        if guild_id is None:
+            return
+        board = self.guild_boards.get(guild_id)
+        if board is None:
+            board = self.guild_boards[guild_id] = Leaderboard()
+        board.add(user_id, experience)
+
+    def guild(self, guild_id: int) -> Leaderboard:
+        return self.guild_boards.get(guild_id) or Leaderboard()
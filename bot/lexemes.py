@@ -0,0 +1,82 @@
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Dict, List
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.collection import Collection
+
+from bot.korean import initial_letter
+
+# The metadata document that records the last build that ran to completion
+METADATA_ID = 'lexemes'
+
+# Indexes earlier versions built for queries on the derived fields, which nothing ever ran
+UNUSED_INDEXES = ('first_char_1_length_1', 'first_char_alt_1', 'last_char_1')
+
+
+def lexeme_document(word: str, homographs: int) -> Dict[str, Any]:
+    """
+    One document per surface form of the words collection. The bot loads the words into its in-memory
+    Lexicon, which answers the game's queries, so the derived fields are kept for analysis and are not indexed.
+    """
+    return {
+        'word': word,
+        'first_char': word[0],
+        'last_char': word[-1],
+        # The first and last character under the initial letter law (두음 법칙), or None if it doesn't apply
+        'first_char_alt': initial_letter(word[0]),
+        'last_char_alt': initial_letter(word[-1]),
+        'length': len(word),
+        'homographs': homographs,
+    }
+
+
+def ensure_lexeme_indexes(lexemes: Collection) -> None:
+    lexemes.create_index('word', unique=True)
+    existing = lexemes.index_information()
+    for name in UNUSED_INDEXES:
+        if name in existing:
+            lexemes.drop_index(name)
+
+
+def rebuild_lexemes(words: Collection, lexemes: Collection, batch_size: int = 1000) -> int:
+    """
+    Derives the lexemes collection from the words collection and returns the number of lexemes.
+    The words are streamed in (word, word_number) index order, so the homographs of a word arrive together.
+    Every lexeme written is stamped with the id of the build, and lexemes from earlier builds are removed at the end,
+    so an interrupted rebuild only leaves stale extras behind until the next one.
+    The id of a build that completes is recorded in the metadata collection, see lexemes_complete.
+    """
+    ensure_lexeme_indexes(lexemes)
+    build_id = ObjectId()
+    cursor = words.find({}, {'_id': 0, 'word': 1}).sort([('word', ASCENDING), ('word_number', ASCENDING)])
+
+    count = 0
+    operations: List[ReplaceOne] = []
+    for word, homographs in groupby(doc['word'] for doc in cursor):
+        if not word:
+            continue
+        document = lexeme_document(word, sum(1 for _ in homographs))
+        document['build_id'] = build_id
+        operations.append(ReplaceOne({'word': word}, document, upsert=True))
+        count += 1
+        if len(operations) >= batch_size:
+            lexemes.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        lexemes.bulk_write(operations, ordered=False)
+
+    lexemes.delete_many({'build_id': {'$ne': build_id}})
+    lexemes.database['metadata'].update_one(
+        {'_id': METADATA_ID}, {'$set': {'build_id': build_id, 'count': count, 'built_at': datetime.now()}}, upsert=True)
+    return count
+
+
+def lexemes_complete(lexemes: Collection) -> bool:
+    """
+    Whether a build of the lexemes collection ever ran to completion. Until then the collection may hold only
+    part of the dictionary.
+    """
+    result = lexemes.database['metadata'].find_one({'_id': METADATA_ID})
+    return bool(result and result.get('build_id'))
@@ -0,0 +1,95 @@
+from bisect import bisect_left
+from collections import defaultdict, Counter
+from typing import Dict, Iterable, Set, AbstractSet, Mapping, List
+import random
+
+from bot.korean import initial_letter, to_jamo, to_jamo_many
+from bot.lru import LRUCache
+
+
+class Lexicon:
+    """
+    In-memory index of every unique word in the dictionary, grouped by its first character.
+    It is loaded once at startup so that game state checks never need a database round trip.
+
+    The words also form a syllable transition graph: each word is an edge from its first to its last character.
+    transitions[first][last] counts those edges, and first_char_counts holds the out-degree of every syllable.
+    """
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self.words: Set[str] = set()
+        self.by_first_char: Dict[str, Set[str]] = defaultdict(set)
+        self.transitions: Dict[str, Counter] = defaultdict(Counter)
+
+        for word in words:
+            if not word or word in self.words:
+                continue
+            self.words.add(word)
+            self.by_first_char[word[0]].add(word)
+            self.transitions[word[0]][word[-1]] += 1
+
+        self.first_char_counts: Dict[str, int] = {char: len(char_words) for char, char_words in self.by_first_char.items()}
+        self.starting_words: List[str] = self._build_starting_words()
+
+        # Sorted jamo keys for prefix search, e.g. '사ㄱ' matches '사과' through 'ㅅㅏㄱ' <= 'ㅅㅏㄱㅗㅏ'
+        jamo_index = sorted(zip(to_jamo_many(self.words), self.words))
+        self._jamo_keys = [key for key, _ in jamo_index]
+        self._jamo_words = [word for _, word in jamo_index]
+        self.autocomplete_cache: LRUCache[str, List[str]] = LRUCache(max_size=4096)
+
+    def _build_starting_words(self, min_length: int = 3, min_linkable: int = 3) -> List[str]:
+        """
+        Words that make a good start for a game: at least min_length characters long
+        and followed by at least min_linkable words.
+        """
+        pool = [word for word in self.words
+                if len(word) >= min_length and self.remaining_moves(word[-1], {}) >= min_linkable]
+        # Small dictionaries may not have a single word that qualifies, any word is better than none
+        return sorted(pool or self.words)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def words_starting_with(self, char: str) -> AbstractSet[str]:
+        return self.by_first_char.get(char, frozenset())
+
+    def remaining_moves(self, last_char: str, used_counts: Mapping[str, int]) -> int:
+        """
+        Returns how many words can still follow last_char, including the initial letter law (두음 법칙).
+        used_counts maps a first character to the number of words starting with it that were already used.
+        """
+        remaining = max(self.first_char_counts.get(last_char, 0) - used_counts.get(last_char, 0), 0)
+        alternate_char = initial_letter(last_char)
+        if alternate_char is not None:
+            remaining += max(self.first_char_counts.get(alternate_char, 0) - used_counts.get(alternate_char, 0), 0)
+        return remaining
+
+    def can_continue(self, last_char: str, used_counts: Mapping[str, int]) -> bool:
+        return self.remaining_moves(last_char, used_counts) > 0
+
+    def random_starting_word(self) -> str:
+        if not self.starting_words:
+            raise ValueError('The lexicon is empty')
+        return random.choice(self.starting_words)
+
+    def autocomplete(self, prefix: str, limit: int = 15) -> List[str]:
+        """
+        Returns up to limit words starting with prefix. The prefix may end in a half-typed syllable.
+        """
+        results = self.autocomplete_cache.get(prefix)
+        if results is not None:
+            return results
+
+        key = to_jamo(prefix)
+        results = []
+        index = bisect_left(self._jamo_keys, key)
+        while index < len(self._jamo_keys) and len(results) < limit and self._jamo_keys[index].startswith(key):
+            results.append(self._jamo_words[index])
+            index += 1
+        results.sort()
+
+        self.autocomplete_cache.put(prefix, results)
+        return results
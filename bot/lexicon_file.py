@@ -0,0 +1,143 @@
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# File layout, every integer is a little-endian uint32:
+#   header        MAGIC, VERSION, word_count, pointer_count, strings_size
+#   word_offsets  word_count + 1 offsets into the strings blob
+#   def_offsets   word_count + 1 offsets into the pointer array
+#   pointers      pointer_count 12-byte ObjectIds of the definition documents
+#   strings       UTF-8 encoded words, sorted, which sorts them by code point as well
+MAGIC = 0x584C4B4B  # 'KKLX'
+VERSION = 2
+HEADER = struct.Struct('<5I')
+POINTER_SIZE = 12
+
+
+def write_lexicon_file(path: str, entries: Iterable[Tuple[str, bytes]]) -> int:
+    """
+    Compiles (word, definition document id) pairs into a read-only lexicon file and returns the number of words.
+    The file is written next to path and renamed over it, so processes that mapped the old file keep working.
+    """
+    pointers: Dict[str, List[bytes]] = {}
+    for word, pointer in entries:
+        if word:
+            pointers.setdefault(word, []).append(pointer)
+    words = sorted(pointers)
+
+    encoded = [word.encode('utf-8') for word in words]
+    word_offsets = [0]
+    for word_bytes in encoded:
+        word_offsets.append(word_offsets[-1] + len(word_bytes))
+
+    def_offsets = [0]
+    for word in words:
+        def_offsets.append(def_offsets[-1] + len(pointers[word]))
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(words), def_offsets[-1], word_offsets[-1]))
+        f.write(struct.pack(f'<{len(word_offsets)}I', *word_offsets))
+        f.write(struct.pack(f'<{len(def_offsets)}I', *def_offsets))
+        for word in words:
+            for pointer in pointers[word]:
+                if len(pointer) != POINTER_SIZE:
+                    raise ValueError(f'Definition pointer of {word} is not {POINTER_SIZE} bytes long')
+                f.write(pointer)
+        for word_bytes in encoded:
+            f.write(word_bytes)
+    os.replace(temp_path, path)
+    return len(words)
+
+
+def is_current(path: str) -> bool:
+    """
+    Whether path holds a lexicon file this version of the reader can map.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return False
+    return len(header) == HEADER.size and HEADER.unpack(header)[:2] == (MAGIC, VERSION)
+
+
+class MappedLexicon:
+    """
+    Read-only view of a file written by write_lexicon_file. It saves the bot the scan of the words collection
+    at startup and maps each word to its definition documents, so loading definitions is a lookup by _id.
+    The Lexicon built from it is still an in-memory copy per process, and membership checks go to that.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.word_count, pointer_count, strings_size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} lexicon file')
+
+        if sys.byteorder != 'little':
+            raise ValueError('Lexicon files can only be mapped on little-endian hosts')
+        view = memoryview(self._mmap)
+        position = HEADER.size
+
+        def take_uint32(count: int) -> memoryview:
+            nonlocal position
+            section = view[position:position + 4 * count].cast('I')
+            position += 4 * count
+            return section
+
+        self._word_offsets = take_uint32(self.word_count + 1)
+        self._def_offsets = take_uint32(self.word_count + 1)
+        self._pointers_start = position
+        self._strings_start = position + POINTER_SIZE * pointer_count
+        if self._strings_start + strings_size > len(self._mmap):
+            raise ValueError(f'{path} is truncated')
+
+    def __len__(self) -> int:
+        return self.word_count
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.word_count):
+            yield self.word_at(index)
+
+    def __contains__(self, word: str) -> bool:
+        return self.index(word) is not None
+
+    def _word_bytes(self, index: int) -> bytes:
+        start = self._strings_start + self._word_offsets[index]
+        end = self._strings_start + self._word_offsets[index + 1]
+        return self._mmap[start:end]
+
+    def _bisect(self, key: bytes, lo: int = 0, hi: Optional[int] = None) -> int:
+        hi = self.word_count if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def word_at(self, index: int) -> str:
+        return self._word_bytes(index).decode('utf-8')
+
+    def index(self, word: str) -> Optional[int]:
+        key = word.encode('utf-8')
+        index = self._bisect(key)
+        if index < self.word_count and self._word_bytes(index) == key:
+            return index
+        return None
+
+    def definition_pointers(self, word: str) -> List[bytes]:
+        """
+        Raw 12-byte ObjectIds of the documents that define word.
+        """
+        index = self.index(word)
+        if index is None:
+            return []
+        start = self._pointers_start + POINTER_SIZE * self._def_offsets[index]
+        end = self._pointers_start + POINTER_SIZE * self._def_offsets[index + 1]
+        return [self._mmap[position:position + POINTER_SIZE] for position in range(start, end, POINTER_SIZE)]
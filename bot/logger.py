@@ -1,5 +1,11 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+from typing import Dict, Tuple
 
 
 # Custom Formatter with Colors
@@ -24,23 +30,109 @@ class Logger(logging.Formatter):
         logging.CRITICAL: "⚠",
     }
 
+    TIME_FORMAT = '%m.%d %H:%M:%S'
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._second = None
+        self._time_text = ''
+
+    def timestamp(self, created: float) -> str:
+        # Records arrive many per second, the text only changes once a second
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._time_text = time.strftime(self.TIME_FORMAT, time.localtime(second))
+        return self._time_text
+
     def format(self, record):
-        current_time = datetime.now().strftime('%m.%d %H:%M:%S')
+        current_time = self.timestamp(record.created)
         level_icon = self.LOG_LEVEL_ICONS.get(record.levelno, 'ℹ️')
         level_color = self.COLOR_CODES.get(record.levelno, "\033[0m")  # Default color if not found
+        suppressed = getattr(record, 'suppressed', 0)
+        suffix = f" \033[90m(+{suppressed} suppressed)" if suppressed else ''
 
-        log_message = f"\033[92m\033[1m{level_icon}\033[0m\033[92m {current_time}\033[37m: {level_color}{record.getMessage()}\033[0m"
+        log_message = f"\033[92m\033[1m{level_icon}\033[0m\033[92m {current_time}\033[37m: {level_color}{record.getMessage()}{suffix}\033[0m"
         return log_message
 
 
+class JsonLogger(Logger):
+    """One JSON object per line, for log collectors."""
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def format(self, record):
+        entry = {
+            'time': f'{self.timestamp(record.created)}.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `rate` records per second through from each logging call site, counting the ones it drops.
+    The next record that gets through carries the count as record.suppressed. Errors always pass.
+    """
+
+    def __init__(self, rate: int = 20) -> None:
+        super().__init__()
+        self.rate = rate
+        self._windows: Dict[Tuple[str, int], list] = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self.rate:
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window[0] != second:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [second, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                return False
+        record.suppressed = suppressed
+        return True
+
+
+# Records are formatted and written by a background thread, so logging never blocks the event loop on I/O
+_queue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(Logger())
+_rate_limit = RateLimitFilter()
+_queue_handler = QueueHandler(_queue)
+_queue_handler.addFilter(_rate_limit)
+_listener = QueueListener(_queue, _stream_handler)
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def configure_logging(log_format: str = 'text', rate_limit: int = 20) -> None:
+    """
+    Switches the output to 'text' or 'json', and sets how many records per second each call site may log
+    below the error level (0 for no limit).
+    """
+    _stream_handler.setFormatter(JsonLogger() if log_format == 'json' else Logger())
+    _rate_limit.rate = rate_limit
+
+
 def get_custom_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
 
     if not logger.handlers:
-        console_handler = logging.StreamHandler()
-        formatter = Logger()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        logger.addHandler(_queue_handler)
 
     return logger
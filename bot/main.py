@@ -1,29 +1,96 @@
+import asyncio
 import math
 
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 from nextcord import SlashOption
 
-from bot.logger import get_custom_logger
-from bot.db import DB
+from bot.logger import configure_logging, get_custom_logger
+from bot.db import DB, AsyncDB
+from bot.cache import GuildCache, UserStatsWriter
 from bot.embeds import SimpleEmbed
+from bot.game import WordChainGame
+from bot.leaderboard import ExperienceHistogram, Leaderboards
+from bot.metrics import metrics, start_metrics_server
+from bot.outbox import Outbox
+from bot.solo import SoloGames
 from bot.model import Word
-from bot.korean import eh_or_ehro, word_with_initial, el_or_rel
 
 import nextcord
 import platform
 import json
+import os
 
 log = get_custom_logger(__name__)
 embed = SimpleEmbed()
 
 with open('config.json', 'r') as file:
     config = json.load(file)
+configure_logging(config.get('log_format', 'text'), config.get('log_rate_limit', 20))
+
+db = AsyncDB(DB(definition_cache_size=config.get('definition_cache_size', 4096),
+                lexicon_path=config.get('lexicon_file', 'lexicon.bin')),
+             max_workers=config.get('db_workers', 8), max_pending=config.get('db_max_pending', 64))
+guilds = GuildCache(db, flush_interval=config.get('guild_flush_interval', 5.0),
+                    max_dirty=config.get('guild_flush_max_dirty', 50))
+leaderboards = Leaderboards()
+users = UserStatsWriter(db, flush_interval=config.get('user_flush_interval', 5.0),
+                        max_dirty=config.get('user_flush_max_dirty', 200), leaderboards=leaderboards,
+                        cache_ttl=config.get('user_cache_ttl', 30.0))
+outbox = Outbox(rate=config.get('channel_send_rate', 5), period=config.get('channel_send_period', 5.0),
+                stale_after=config.get('notice_stale_after', 3.0), delete_delay=config.get('delete_batch_delay', 0.5))
+game = WordChainGame(db, guilds, users, outbox)
+solo_games = SoloGames(db, outbox, idle_timeout=config.get('solo_idle_timeout', 300))
+log.info('Connected to the database')
 
-intents = nextcord.Intents.all()
-client = commands.Bot(intents=intents)
+metrics.slow_threshold = config.get('slow_query_ms', 100) / 1000
+metrics.instrument(db.db, 'kkeutmal_db_seconds')
+metrics.describe('kkeutmal_db_seconds', 'Time spent in DB methods')
+metrics.describe('kkeutmal_command_seconds', 'Time spent handling slash commands')
+metrics.describe('kkeutmal_discord_seconds', 'Time spent in Discord API calls')
+metrics.describe('kkeutmal_solo_reply_seconds', 'Time the solver takes to pick a reply in solo games')
+metrics.gauge('kkeutmal_cache_hit_ratio', lambda: db.db.definition_cache.hit_rate, 'Cache hit ratio',
+              cache='definitions')
+metrics.gauge('kkeutmal_cache_hit_ratio', lambda: db.lexicon.autocomplete_cache.hit_rate, cache='autocomplete')
+metrics.gauge('kkeutmal_cache_hit_ratio', lambda: users.cache_hit_rate, cache='users')
+metrics.gauge('kkeutmal_queue_depth', lambda: db.in_flight, 'Pending items per queue', queue='db')
+metrics.gauge('kkeutmal_queue_depth', lambda: guilds.dirty_count, queue='guild_writes')
+metrics.gauge('kkeutmal_queue_depth', lambda: users.dirty_count, queue='user_writes')
+metrics.gauge('kkeutmal_queue_depth', lambda: outbox.pending, queue='outbox')
+metrics.gauge('kkeutmal_solo_sessions', lambda: len(solo_games.sessions), 'Running solo games')
+# Off unless configured, the launcher always sets it since it polls /health
+metrics_port = int(os.environ['KKEUTMAL_METRICS_PORT']) if 'KKEUTMAL_METRICS_PORT' in os.environ \
+    else config.get('metrics_port')
+
+
+class KkeutmalBot(commands.AutoShardedBot):
+    async def start(self, *args, **kwargs) -> None:
+        # Serve /health before logging in, so the launcher can tell a slow start from a dead process
+        if metrics_port:
+            try:
+                await start_metrics_server(config.get('metrics_host', '127.0.0.1'), metrics_port, health=self.is_ready)
+            except OSError as e:
+                # Monitoring is optional, the bot runs without it
+                log.error('Failed to serve metrics on port %s: %s', metrics_port, e)
+        await super().start(*args, **kwargs)
+
+    async def close(self) -> None:
+        # Make sure no game state is lost when the bot shuts down
+        await guilds.close()
+        await users.close()
+        outbox.close()
+        await super().close()
+
+
+# The launcher runs one process per shard range, a process started on its own runs every shard
+shard_options = {}
+if 'KKEUTMAL_SHARD_IDS' in os.environ:
+    shard_options['shard_ids'] = [int(shard_id) for shard_id in os.environ['KKEUTMAL_SHARD_IDS'].split(',')]
+    shard_options['shard_count'] = int(os.environ['KKEUTMAL_SHARD_COUNT'])
+elif config.get('shard_count'):
+    shard_options['shard_count'] = config['shard_count']
 
-db = DB()
-log.info('Connected to the database')
+intents = nextcord.Intents.all()
+client = KkeutmalBot(intents=intents, **shard_options)
 
 
 class WordDefinitionSelect(nextcord.ui.Select):
@@ -38,8 +105,8 @@ class WordDefinitionSelect(nextcord.ui.Select):
             super().__init__(placeholder='정의를 선택하세요', options=options, max_values=1, min_values=1)
 
     async def callback(self, interaction: nextcord.Interaction):
-        log.info(f'{interaction.user.name}({interaction.user.id}) selected: {interaction.data["values"][0]} in'
-                 f' {interaction.message.id}')
+        log.info('%s(%s) selected: %s in %s', interaction.user.name, interaction.user.id,
+                 interaction.data['values'][0], interaction.message.id)
         def_id = int(interaction.data['values'][0])
         definition = next((d for d in self.definitions if d.word_number == def_id), None)
         await interaction.message.edit(embed=definition.to_embed())
@@ -62,9 +129,40 @@ class WordDefinitionSelectView(nextcord.ui.View):
         self.stop()
 
 
+@tasks.loop(seconds=config.get('lexicon_refresh_interval', 300))
+async def refresh_lexicon():
+    if await db.refresh_lexicon():
+        await solo_games.refresh()
+        log.info(f'Dictionary changed, reloaded {len(db.lexicon)} words')
+
+
+@tasks.loop(seconds=config.get('leaderboard_refresh_interval', 600))
+async def refresh_leaderboards():
+    # Moves are added to the boards as they are played, this fixes drift and picks up guilds this process
+    # took over. Only the guilds on this process's shards are loaded.
+    leaderboards.global_histogram = ExperienceHistogram(await db.load_experience_histogram())
+    for _ in range(3):
+        if users.writing:
+            await asyncio.sleep(1)
+            continue
+        writes_started = users.writes_started
+        member_scores = await db.load_guild_leaderboards([guild.id for guild in client.guilds])
+        # A flush that started during the read may or may not be in it, so the read is only used without one.
+        # Without one, everything not in the read is still pending.
+        if not users.writing and users.writes_started == writes_started:
+            leaderboards.load(member_scores, users.pending_guild_experience())
+            return
+    log.warning('Skipped a leaderboard refresh, user statistics were being written the whole time')
+
+
 # Bot startup
 @client.event
 async def on_ready():
+    if not refresh_lexicon.is_running():
+        refresh_lexicon.start()
+    if not refresh_leaderboards.is_running():
+        refresh_leaderboards.start()
+
     # set status
     await client.change_presence(activity=nextcord.Game(name='/도움말 | 끝말잇기'))
 
@@ -72,94 +170,26 @@ async def on_ready():
     log.info('Bot is ready')
     log.info('======================================')
     log.info(f'Logged in as {client.user.name}#{client.user.discriminator} ({client.user.id})')
+    log.info(f'Running shards {sorted(client.shards)} of {client.shard_count} with {len(client.guilds)} guilds')
     log.info(f'Currenly running nextcord {nextcord.__version__} on python {platform.python_version()}')
     log.info('======================================')
 
 
 @client.event
 async def on_message(message):
-    if message.author.bot:
-        return
-
-    if message.content.startswith('> '):
-        return
-
-    guild_data = db.get_guild(message.guild.id)
-    if guild_data.word_chain_channel_id() == message.channel.id:
-        message_content = message.content.strip()
-        await message.delete()
-
-        if len(message_content) < 2:
-            await message.channel.send(
-                embed=embed.error(f'2글자 이상의 단어를 입력해주세요.', footer='팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!'),
-                delete_after=5)
-            return
-
-        last_char, altnative_char = guild_data.get_last_character()
-
-        if message_content[0] != last_char and message_content[0] != altnative_char:
-            linkable_char = guild_data.get_linkable_char_str()
-
-            await message.channel.send(
-                embed=embed.error(
-                    text=f'단어의 첫 글자가 일치하지 않습니다.\n"**{linkable_char}**"{eh_or_ehro(last_char[0])} 시작하는 단어를 입력해주세요.',
-                    footer=f'팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!'), delete_after=5)
-            return
-
-        if guild_data.is_word_in_chain(message_content):
-            await message.channel.send(
-                embed=embed.error(f'이미 [여기서]({guild_data.get_word_message_url(message_content)}) 사용된 단어입니다.'),
-                delete_after=5)
-            return
-
-        if not db.word_exists(message_content):
-            await message.channel.send(
-                embed=embed.error(f'존재하지 않는 단어입니다.', footer='팁: "> " 를 메세지 앞에 붙여 채팅메세지를 입력할 수 있습니다!'), delete_after=5)
-            return
-
-        prev_word = guild_data.get_last_word()
-        next_word = db.get_definitions(message_content)[0]
-
-        description_text = f'[{next_word.pronunciations}]' if next_word.pronunciations else ''
-        description_text += f' `{next_word.word_type}`' if next_word.word_type else ''
-        description_text += f' `{next_word.word_unit}`' if next_word.word_unit else ''
-
-        next_embed = nextcord.Embed(title=f'{word_with_initial(prev_word)} → {word_with_initial(message_content)}',
-                                    description=description_text, color=0x2B2D31)
-        next_embed.add_field(name=f'뜻풀이', value=SimpleEmbed.format_def(next_word), inline=False)
-        next_embed.set_author(name=message.author.display_name, icon_url=message.author.avatar.url)
-        next_embed.set_footer(text=f'콤보: {len(guild_data.word_chain)} | 최고 콤보: {guild_data.best_combo}')
-        next_message = await message.channel.send(embed=next_embed)
-
-        guild_data.add_word(message_content, next_message.id)
-        db.update_guild(guild_data)
-
-        # Determine if the game is over
-        if not db.can_play(guild_data):
-            game_over_embed = nextcord.Embed(title='게임 오버!',
-                                             description=f'더이상 "**{word_with_initial(message_content)}**"'
-                                                         f'{el_or_rel(message_content[-1])} 이을 수 있는 단어가 없습니다!',
-                                             color=0xE74C3B)
-            game_over_embed.set_footer(text=f'최종 콤보: {len(guild_data.word_chain)}')
-            await message.channel.send(embed=game_over_embed)
-
-            start_word = db.find_valid_starting_word()
-            start_msg = await message.channel.send(embed=embed.game_start(db.get_definitions(start_word)[0]))
-            guild_data.initialize_chain(start_word, start_msg.id)
-            db.update_guild(guild_data)
-
-        user_data = db.get_user(message.author.id)
-        db.add_user_word(user_data, message_content)
-        db.add_user_experience(user_data, len(message_content) ** 2)
+    await game.on_message(message)
+    await solo_games.on_message(message)
 
 
 @client.slash_command(name='핑', description='봇의 핑을 확인합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='ping')
 async def ping(ctx):
-    is_word_chain_channel = db.get_guild(ctx.guild.id).is_word_chain_channel(ctx.channel.id)
+    is_word_chain_channel = (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id)
     await ctx.send(embed=embed.success(f'퐁! {round(client.latency * 1000)}ms'), ephemeral=is_word_chain_channel)
 
 
 @client.slash_command(name='설정', description='현재 명령어를 사용한 채널을 끝말잇기 채널로 설정합니다.', default_member_permissions=8)
+@metrics.timed('kkeutmal_command_seconds', command='set_channel')
 async def set_channel(ctx):
     if not ctx.channel.permissions_for(ctx.guild.me).send_messages:
         await ctx.response.send_message(embed=embed.error("끝말잇기 채널로 설정할 수 없습니다. 봇이 메시지를 보낼 권한이 없습니다."), ephemeral=True)
@@ -168,9 +198,8 @@ async def set_channel(ctx):
         await ctx.response.send_message(embed=embed.error("끝말잇기 채널로 설정할 수 없습니다. 봇이 메시지를 수정할 권한이 없습니다."), ephemeral=True)
         return
 
-    guild_data = db.get_guild(ctx.guild.id)
+    guild_data = await guilds.get(ctx.guild.id)
     existing_channel = guild_data.word_chain_channel_id()
-    guild_data.word_chain_channel = ctx.channel.id
     if existing_channel is None:
         await ctx.response.send_message(embed=embed.success(f'끝말잇기 채널이 {ctx.channel.mention}로 설정되었습니다.'),
                                         ephemeral=True)
@@ -179,21 +208,25 @@ async def set_channel(ctx):
             embed=embed.success(f"끝말잇기 채널이 <#{existing_channel}>에서 현재 채널로 변경 되었습니다."),
             ephemeral=True)
 
-    start_word = db.find_valid_starting_word()
-    start_msg = await ctx.channel.send(embed=embed.game_start(db.get_definitions(start_word)[0]))
-    guild_data.initialize_chain(start_word, start_msg.id)
-    db.update_guild(guild_data)
+    async with game.guild_lock(ctx.guild.id):
+        start_word = db.find_valid_starting_word()
+        start_msg = await ctx.channel.send(embed=embed.game_start((await db.get_definitions(start_word))[0]))
+        # The cached guild only changes once the game has started, so a failed send leaves nothing half set up
+        guild_data.word_chain_channel = ctx.channel.id
+        guild_data.initialize_chain(start_word, start_msg.id)
+        guilds.update(guild_data)
 
 
 @client.slash_command(name='프로필', description='자신 또는 다른 사용자의 프로필을 확인합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='profile')
 async def profile(ctx, user: nextcord.Member = SlashOption(name="사용지", description="프로필을 확인할 사용자를 입력해 주세요.",
                                                            required=False)):
-    is_word_chain_channel = db.get_guild(ctx.guild.id).is_word_chain_channel(ctx.channel.id)
+    is_word_chain_channel = (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id)
     if not user:
         user = ctx.user
 
-    user_data = db.get_user(user.id)
-    log.info(f'{ctx.user.name}({ctx.user.id}) requested profile of {user.name}({user.id})')
+    user_data = await users.get(user.id)
+    log.info('%s(%s) requested profile of %s(%s)', ctx.user.name, ctx.user.id, user.name, user.id)
     description_text = f'경험치: **{user_data.experience}**\n사용한 단어 수: **{user_data.total_words}**\n\n\n__**자주 사용한 단어**__'
 
     user_embed = nextcord.Embed(title=f'{user.display_name}의 프로필', description=description_text,
@@ -201,35 +234,40 @@ async def profile(ctx, user: nextcord.Member = SlashOption(name="사용지", des
     user_embed.set_thumbnail(url=user.avatar.url)
     user_embed.set_footer(text=f'사용자 ID: {user.id}')
 
-    favorite_words = db.get_favorite_words(user_data, 10)
-    for word in favorite_words:
-        word_obj = db.get_definitions(list(word.keys())[0])[0]
-        user_embed.add_field(name=f'◼︎ {list(word.keys())[0]} - {list(word.values())[0]} 회 사용',
-                             value=embed.format_def(word_obj, '> '), inline=False)
+    favorite_words = await users.favorite_words(user.id, 10)
+    definitions = await db.get_definitions_many([word_text for word_text, _ in favorite_words])
+    for word_text, count in favorite_words:
+        if not definitions.get(word_text):
+            continue
+        user_embed.add_field(name=f'◼︎ {word_text} - {count} 회 사용',
+                             value=embed.format_def(definitions[word_text][0], '> '), inline=False)
 
     await ctx.send(embed=user_embed, ephemeral=is_word_chain_channel)
 
 
 @client.slash_command(name='재시작', description='끝말잇기 게임을 재시작합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='restart')
 async def restart(ctx):
-    guild_data = db.get_guild(ctx.guild.id)
-    start_word = db.find_valid_starting_word()
+    guild_data = await guilds.get(ctx.guild.id)
     await ctx.send(embed=embed.success('끝말잇기 게임이 재시작되었습니다.'))
-    start_msg = await ctx.channel.send(embed=embed.game_start(db.get_definitions(start_word)[0]))
-    guild_data.initialize_chain(start_word, start_msg.id)
-    db.update_guild(guild_data)
+    async with game.guild_lock(ctx.guild.id):
+        start_word = db.find_valid_starting_word()
+        start_msg = await ctx.channel.send(embed=embed.game_start((await db.get_definitions(start_word))[0]))
+        guild_data.initialize_chain(start_word, start_msg.id)
+        guilds.update(guild_data)
 
 
 @client.slash_command(name='사전', description='단어의 뜻을 확인합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='search')
 async def search(ctx, word: str = SlashOption(name="단어", description="검색할 단어를 입력해 주세요.")):
-    log.info(f'{ctx.user.name}({ctx.user.id}) searched: {word}')
-    is_word_chain_channel = db.get_guild(ctx.guild.id).is_word_chain_channel(ctx.channel.id)
+    log.info('%s(%s) searched: %s', ctx.user.name, ctx.user.id, word)
+    is_word_chain_channel = (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id)
 
     if is_word_chain_channel:
         await ctx.response.send_message(embed=embed.error('끝말잇기 채널에서는 사용할 수 없는 명령어입니다.'), ephemeral=True)
         return
 
-    definitions = db.get_definitions(word)
+    definitions = await db.get_definitions(word)
     if len(definitions) == 0:
         await ctx.send(embed=embed.error(f'`{word}`에 대한 뜻풀이를 찾을 수 없습니다.'), ephemeral=True)
         return
@@ -243,6 +281,7 @@ async def search(ctx, word: str = SlashOption(name="단어", description="검색
 
 
 @search.on_autocomplete("word")
+@metrics.timed('kkeutmal_command_seconds', command='search_autocomplete')
 async def preview(ctx, word: str):
     if word:
         await ctx.response.send_autocomplete(db.autocomplete(word))
@@ -250,14 +289,58 @@ async def preview(ctx, word: str):
         await ctx.response.send_autocomplete([])
 
 
+@client.slash_command(name='솔로', description='봇과 1:1 끝말잇기를 시작합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='solo')
+async def solo(ctx):
+    if (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id):
+        await ctx.response.send_message(embed=embed.error('끝말잇기 채널에서는 사용할 수 없는 명령어입니다.'), ephemeral=True)
+        return
+
+    start_word = solo_games.start(ctx.channel.id, ctx.user.id)
+    start_embed = embed.game_start((await db.get_definitions(start_word))[0],
+                                   footer=f'{ctx.user.display_name}님과 봇의 1:1 끝말잇기입니다. 이어지는 단어를 입력하세요.')
+    await ctx.send(embed=start_embed)
+
+
+@client.slash_command(name='랭킹', description='경험치 순위를 확인합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='ranking')
+async def ranking(ctx, scope: str = SlashOption(name="범위", description="순위를 볼 범위를 선택해 주세요.",
+                                                choices={'서버': 'guild', '전체': 'global'}, required=False,
+                                                default='guild')):
+    is_word_chain_channel = (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id)
+    if scope == 'global':
+        title = '전체 랭킹'
+        top = await db.global_top(10)
+        histogram = leaderboards.global_histogram
+        # The user's own experience includes what isn't written yet, everyone else's is as of the last refresh
+        experience = (await users.get(ctx.user.id)).experience
+        standing = (histogram.rank(experience), experience) if experience > 0 else None
+        total = max(histogram.total, standing[0] if standing else 0)
+    else:
+        title = f'{ctx.guild.name} 랭킹'
+        board = leaderboards.guild(ctx.guild.id)
+        top, total = board.top(10), len(board)
+        rank = board.rank(ctx.user.id)
+        standing = (rank, board.score(ctx.user.id)) if rank is not None else None
+
+    lines = [f'**{rank}.** <@{user_id}> - {score} 경험치' for rank, user_id, score in top]
+    ranking_embed = nextcord.Embed(title=title, description='\n'.join(lines) or '아직 순위가 없습니다.', color=0x2B2D31)
+    if standing is not None:
+        ranking_embed.set_footer(text=f'내 순위: {standing[0]}위 / {total}명 ({standing[1]} 경험치)')
+    await ctx.send(embed=ranking_embed, ephemeral=is_word_chain_channel)
+
+
 @client.slash_command(name='도움말', description='봇의 명령어 목록을 확인합니다.')
+@metrics.timed('kkeutmal_command_seconds', command='help')
 async def help_menu(ctx):
-    is_word_chain_channel = db.get_guild(ctx.guild.id).is_word_chain_channel(ctx.channel.id)
+    is_word_chain_channel = (await guilds.get(ctx.guild.id)).is_word_chain_channel(ctx.channel.id)
 
     help_embed = nextcord.Embed(title='도움말', description='끝말잇기 봇의 명령어 목록입니다.', color=0x2B2D31)
     help_embed.add_field(name='`/핑`', value='봇의 핑을 확인합니다.', inline=False)
     help_embed.add_field(name='`/설정`', value='현재 명령어를 사용한 채널을 끝말잇기 채널로 설정합니다.', inline=False)
     help_embed.add_field(name='`/재시작`', value='끝말잇기 게임을 재시작합니다.', inline=False)
+    help_embed.add_field(name='`/솔로`', value='봇과 1:1 끝말잇기를 시작합니다.', inline=False)
+    help_embed.add_field(name='`/랭킹`', value='서버 또는 전체 경험치 순위를 확인합니다.', inline=False)
     help_embed.add_field(name='`/뜻풀이`', value='단어의 뜻을 확인합니다.', inline=False)
     help_embed.add_field(name='`/도움말`', value='봇의 명령어 목록을 확인합니다.', inline=False)
     help_embed.add_field(name='`/프로필`', value='자신 또는 다른 사용자의 프로필을 확인합니다.', inline=False)
@@ -269,3 +352,5 @@ try:
 except nextcord.errors.LoginFailure:
     log.fatal('Authnetication to Discord failed.')
     exit()
+finally:
+    db.close()
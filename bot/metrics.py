@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from bot.logger import get_custom_logger
+
+log = get_custom_logger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Latency histograms, counters and gauges, rendered in the Prometheus text format.
+    Operations slower than slow_threshold are logged together with their arguments.
+    """
+
+    def __init__(self, slow_threshold: float = 0.1) -> None:
+        self.slow_threshold = slow_threshold
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _labels(labels)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _labels(labels)
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name: str, func: Callable[[], float], help_text: str = '', **labels: Any) -> None:
+        """
+        Registers a gauge whose value is read from func every time the metrics are rendered.
+        """
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = func
+            if help_text:
+                self._help[name] = help_text
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def _record(self, name: str, seconds: float, failed: bool, args: Tuple[Any, ...], labels: Dict[str, Any]) -> None:
+        self.observe(name, seconds, **labels)
+        if failed:
+            self.inc(f'{name.removesuffix("_seconds")}_errors_total', **labels)
+        if seconds >= self.slow_threshold:
+            arguments = ', '.join(repr(arg)[:100] for arg in args)
+            log.warning(f'Slow {name}{_format_labels(_labels(labels))}: {seconds * 1000:.0f}ms ({arguments})')
+
+    @contextmanager
+    def time(self, name: str, *args: Any, **labels: Any) -> Iterator[None]:
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._record(name, time.perf_counter() - started_at, failed, args, labels)
+
+    def timed(self, name: str, **labels: Any) -> Callable[[Callable], Callable]:
+        """
+        Decorator that times every call of a function or coroutine function.
+        """
+        def decorator(func: Callable) -> Callable:
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                    with self.time(name, *args, **labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.time(name, *args, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument(self, obj: Any, name: str, label: str = 'operation') -> None:
+        """
+        Times every public method of obj, labelled with the method name.
+        """
+        for attribute in dir(type(obj)):
+            if attribute.startswith('_'):
+                continue
+            method = getattr(obj, attribute)
+            if inspect.ismethod(method):
+                setattr(obj, attribute, self.timed(name, **{label: attribute})(method))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._histograms.items():
+                self._render_header(lines, name, 'histogram')
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels, ("le", str(bound)))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+            for name, series in self._counters.items():
+                self._render_header(lines, name, 'counter')
+                for labels, value in series.items():
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+
+        for name, series in gauges.items():
+            self._render_header(lines, name, 'gauge')
+            for labels, func in series.items():
+                try:
+                    lines.append(f'{name}{_format_labels(labels)} {float(func())}')
+                except Exception as e:
+                    log.error(f'Failed to read gauge {name}: {e}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_header(self, lines: List[str], name: str, metric_type: str) -> None:
+        if name in self._help:
+            lines.append(f'# HELP {name} {self._help[name]}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+
+metrics = Metrics()
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          health: Callable[[], bool]) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers, nothing in them matters here
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else ''
+
+        if path == '/metrics':
+            status, body = '200 OK', metrics.render()
+        elif path == '/health':
+            status, body = ('200 OK', 'ready\n') if health() else ('503 Service Unavailable', 'starting\n')
+        else:
+            status, body = '404 Not Found', 'not found\n'
+        payload = body.encode('utf-8')
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# Not a port other exporters commonly use, node_exporter's 9100 in particular
+DEFAULT_PORT = 9731
+
+
+async def start_metrics_server(host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                               health: Callable[[], bool] = lambda: True) -> asyncio.AbstractServer:
+    """
+    Serves the metrics at http://host:port/metrics for Prometheus to scrape.
+    /health answers 200 once health() is true and 503 before that, which the launcher polls.
+    """
+    server = await asyncio.start_server(functools.partial(_handle_request, health=health), host, port)
+    log.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
@@ -1,10 +1,11 @@
-from typing import Dict, Any, Optional
-from korean import initial_letter
+from collections import Counter
+from typing import Dict, Any, Optional, List, AbstractSet, Tuple
+from bot.korean import initial_letter
 import nextcord
 import re
 
 superscript = str.maketrans("0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹")
-pattern = r'<[^>]+>.*?</[^>]+>'
+pattern = re.compile(r'<[^>]+>.*?</[^>]+>')
 
 
 class Word:
@@ -18,6 +19,16 @@ class Word:
         self.related_words = word_dict.get('related_words', [])
         self.original_language_info = word_dict.get('original_language_info', [])
 
+        # Rendered once, Word objects are cached and shared between every embed that shows them
+        self.clean_definitions = [pattern.sub('', definition_info['definition']) for definition_info in self.definitions]
+        self.title_text = f'{self.word}'
+        self.title_text += f'{str(self.word_number).translate(superscript)}' if self.word_number else ''
+        self.description_text = f'[{self.pronunciations}]' if self.pronunciations else ''
+        self.description_text += f' `{self.word_type}`' if self.word_type else ''
+        self.description_text += f' `{self.word_unit}`' if self.word_unit else ''
+        self._embed_fields: Optional[List[Tuple[str, str]]] = None
+        self._formatted_definitions: Dict[str, str] = {}
+
     def __str__(self) -> str:
         string_value = f'{self.word}({self.word_number}) [{self.pronunciations}] - {self.word_type} {self.word_unit}'
         for i, definition_info in enumerate(self.definitions):
@@ -28,41 +39,63 @@ class Word:
                 string_value += f' (예: {examples})'
         return string_value
 
-    def to_embed(self) -> nextcord.Embed:
-        title_text = f'{self.word}'
-        title_text += f'{str(self.word_number).translate(superscript)}' if self.word_number else ''
-
-        description_text = f'[{self.pronunciations}]' if self.pronunciations else ''
-        description_text += f' `{self.word_type}`' if self.word_type else ''
-        description_text += f' `{self.word_unit}`' if self.word_unit else ''
-
-        word_embed = nextcord.Embed(title=title_text, description=description_text, color=0x2B2D31)
-
-        for i, definition_info in enumerate(self.definitions):
-            definition = definition_info['definition']
-            definition = re.sub(pattern, '', definition)
-
-            example = ''
-            for j, ex in enumerate(definition_info['examples']):
-                example += f'> **예시 {j + 1}**) {ex}\n'
+    def embed_fields(self) -> List[Tuple[str, str]]:
+        """
+        :return: (name, value) of every definition field shown by to_embed
+        """
+        if self._embed_fields is None:
+            fields = []
+            for i, (definition, definition_info) in enumerate(zip(self.clean_definitions, self.definitions)):
+                example = ''
+                for j, ex in enumerate(definition_info['examples']):
+                    example += f'> **예시 {j + 1}**) {ex}\n'
+                fields.append((f'{i + 1}. {definition}', example))
+            self._embed_fields = fields
+        return self._embed_fields
 
-            word_embed.add_field(name=f'{i + 1}. {definition}', value=f'{example}', inline=False)
+    def to_embed(self) -> nextcord.Embed:
+        word_embed = nextcord.Embed(title=self.title_text, description=self.description_text, color=0x2B2D31)
+        for name, value in self.embed_fields():
+            word_embed.add_field(name=name, value=value, inline=False)
 
         return word_embed
 
+    def format_definitions(self, prefix: str = '') -> str:
+        """
+        :return: Numbered list of the definitions, each line starting with prefix
+        """
+        def_text = self._formatted_definitions.get(prefix)
+        if def_text is None:
+            def_text = ''
+            for i, definition in enumerate(self.clean_definitions):
+                def_text += f'{prefix}`「{i + 1}」` {definition}\n'
+            self._formatted_definitions[prefix] = def_text
+        return def_text
+
     def quick_preview(self) -> str:
         """
         :return: First 25 characters of the first definition
         """
-        return re.sub(pattern, '', self.definitions[0]['definition'])[:25]
+        return self.clean_definitions[0][:25]
 
 
 class Guild:
-    def __init__(self, server_dict: Dict[str, Any]) -> None:
+    def __init__(self, server_dict: Dict[str, Any], word_chain: Optional[List[Dict[str, Any]]] = None) -> None:
         self.guild_id = server_dict.get('server_id')
         self.word_chain_channel = server_dict.get('word_chain_channel', None)
-        self.word_chain = server_dict.get('word_chain', [])
         self.best_combo = server_dict.get('best_combo', 0)
+        self.game_id = server_dict.get('game_id', 0)
+
+        if word_chain is None:
+            # Older documents embed the whole chain, none of which is in the chain collection yet
+            self.word_chain = server_dict.get('word_chain', [])
+            self._persisted_count = 0
+        else:
+            self.word_chain = word_chain
+            self._persisted_count = len(word_chain)
+        self._chain_reset = False
+        self._word_index: Dict[str, int] = {entry['word']: entry['message_id'] for entry in self.word_chain}
+        self.used_by_first_char = Counter(word[0] for word in self._word_index)
 
     def get_last_word(self) -> str:
         return self.word_chain[-1]['word']
@@ -72,6 +105,9 @@ class Guild:
 
     def add_word(self, word: str, message_id: int) -> None:
         self.word_chain.append({'word': word, 'message_id': message_id})
+        if word not in self._word_index:
+            self._word_index[word] = message_id
+            self.used_by_first_char[word[0]] += 1
         currnt_combo = len(self.word_chain)
         if currnt_combo > self.best_combo:
             self.best_combo = currnt_combo
@@ -80,24 +116,53 @@ class Guild:
         return {
             'server_id': self.guild_id,
             'word_chain_channel': self.word_chain_channel,
-            'word_chain': self.word_chain,
-            'best_combo': self.best_combo
+            'best_combo': self.best_combo,
+            'game_id': self.game_id
+        }
+
+    def pending_changes(self) -> Dict[str, Any]:
+        """
+        Snapshot of everything that has to be written: the guild document and the chain entries appended
+        since the last successful write. Pass it back to mark_persisted once the write succeeded.
+        """
+        entries = [{'server_id': self.guild_id, 'game_id': self.game_id, 'index': index, **entry}
+                   for index, entry in enumerate(self.word_chain[self._persisted_count:], self._persisted_count)]
+        return {
+            'document': self.to_dict(),
+            'entries': entries,
+            'reset': self._chain_reset,
+            'game_id': self.game_id,
+            'chain_end': len(self.word_chain)
         }
 
+    def mark_persisted(self, changes: Dict[str, Any]) -> None:
+        # Ignore writes for a game that was restarted while they were in flight
+        if changes['game_id'] != self.game_id:
+            return
+        self._persisted_count = max(self._persisted_count, changes['chain_end'])
+        if changes['reset']:
+            self._chain_reset = False
+
     def is_word_in_chain(self, word: str) -> bool:
-        return word in [word['word'] for word in self.word_chain]
+        return word in self._word_index
 
     def initialize_chain(self, word: str, message_id: int) -> None:
+        self.game_id += 1
         self.word_chain = [{'word': word, 'message_id': message_id}]
+        self._word_index = {word: message_id}
+        self.used_by_first_char = Counter(word[0])
+        self._persisted_count = 0
+        self._chain_reset = True
 
     def get_last_character(self) -> tuple[str, Optional[str]]:
-        return self.get_last_word()[-1], initial_letter(self.get_last_word()[-1])
+        last_char = self.get_last_word()[-1]
+        return last_char, initial_letter(last_char)
 
     def get_word_message_url(self, word: str) -> Optional[str]:
-        for chain in self.word_chain:
-            if chain['word'] == word:
-                return f'https://discord.com/channels/{self.guild_id}/{self.word_chain_channel}/{chain["message_id"]}'
-        return None
+        message_id = self._word_index.get(word)
+        if message_id is None:
+            return None
+        return f'https://discord.com/channels/{self.guild_id}/{self.word_chain_channel}/{message_id}'
 
     def get_linkable_char_str(self) -> str:
         last_char, alt_char = self.get_last_character()
@@ -106,17 +171,30 @@ class Guild:
     def is_word_chain_channel(self, channel_id: int) -> bool:
         return self.word_chain_channel == channel_id
 
+    def used_words(self) -> AbstractSet[str]:
+        return self._word_index.keys()
+
 
 class User:
+    """
+    A user's scalar statistics. How often they played each word is kept in the user_words collection,
+    so loading a user costs the same however long they have been playing.
+    """
+
     def __init__(self, user_dict: dict) -> None:
         self.user_id = user_dict.get('user_id')
-        self.used_words = user_dict.get('used_words', {})
         self.experience = user_dict.get('experience', 0)
         self.total_words = user_dict.get('total_words', 0)
 
+    def add_words(self, count: int = 1) -> None:
+        self.total_words += count
+
+    def add_experience(self, experience: int) -> None:
+        self.experience += experience
+
     def to_dict(self) -> Dict[str, Any]:
         return {
             'user_id': self.user_id,
-            'used_words': self.used_words,
-            'experience': self.experience
+            'experience': self.experience,
+            'total_words': self.total_words
         }
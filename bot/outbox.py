@@ -0,0 +1,223 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import nextcord
+
+from bot.logger import get_custom_logger
+from bot.metrics import metrics
+
+log = get_custom_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows capacity acquisitions per period seconds, refilled continuously.
+    """
+
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self.period = period
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.capacity / self.period)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) * self.period / self.capacity)
+            self._refill()
+        self._tokens -= 1
+
+
+class ChannelOutbox:
+    """
+    Outgoing messages and deletions of one channel.
+    Sends are paced by the channel's rate limit so they queue here, where they can still be reordered and dropped,
+    instead of inside the HTTP client. Moves and game state messages go first. Of the rejection notices only the
+    newest is kept, and it is dropped once it is older than stale_after seconds.
+    Deletions are collected for delete_delay seconds and removed with one bulk delete. Bulk deletes need
+    Manage Messages, so in channels where the bot doesn't have it, messages are deleted one by one,
+    which works for the bot's own messages.
+    """
+
+    def __init__(self, channel: nextcord.TextChannel, rate: int, period: float, stale_after: float,
+                 delete_delay: float) -> None:
+        self.channel = channel
+        self.stale_after = stale_after
+        self.delete_delay = delete_delay
+        self._send_bucket = TokenBucket(rate, period)
+        self._delete_bucket = TokenBucket(rate, period)
+        self._sends: Deque[Tuple[Dict[str, Any], asyncio.Future]] = deque()
+        self._notice: Optional[Tuple[nextcord.Embed, float, float]] = None
+        self._deletions: List[Tuple[float, nextcord.abc.Snowflake]] = []
+        self._send_task: Optional[asyncio.Task] = None
+        self._delete_task: Optional[asyncio.Task] = None
+        # Wakes the delete loop when a deletion is queued that is due before the one it sleeps for
+        self._deletion_added = asyncio.Event()
+        self._bulk_delete = True
+
+    @property
+    def pending(self) -> int:
+        return len(self._sends) + (self._notice is not None) + len(self._deletions)
+
+    def send(self, **kwargs: Any) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._sends.append((kwargs, future))
+        self._start_sending()
+        return future
+
+    def notify(self, embed: nextcord.Embed, delete_after: float) -> None:
+        if self._notice is not None:
+            metrics.inc('kkeutmal_outbox_dropped_total', reason='coalesced')
+        self._notice = (embed, delete_after, time.monotonic())
+        self._start_sending()
+
+    def delete(self, message: nextcord.abc.Snowflake, delay: Optional[float] = None) -> None:
+        self._deletions.append((time.monotonic() + (self.delete_delay if delay is None else delay), message))
+        self._deletion_added.set()
+        if self._delete_task is None or self._delete_task.done():
+            self._delete_task = asyncio.create_task(self._delete_loop())
+
+    def _start_sending(self) -> None:
+        if self._send_task is None or self._send_task.done():
+            self._send_task = asyncio.create_task(self._send_loop())
+
+    def _drop_stale_notice(self) -> None:
+        if self._notice is not None and time.monotonic() - self._notice[2] > self.stale_after:
+            self._notice = None
+            metrics.inc('kkeutmal_outbox_dropped_total', reason='stale')
+
+    async def _send_loop(self) -> None:
+        while self._sends or self._notice is not None:
+            self._drop_stale_notice()
+            if not self._sends and self._notice is None:
+                break
+            await self._send_bucket.acquire()
+
+            if self._sends:
+                kwargs, future = self._sends.popleft()
+                if future.done():
+                    continue
+                try:
+                    with metrics.time('kkeutmal_discord_seconds', operation='send'):
+                        message = await self.channel.send(**kwargs)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                if not future.done():
+                    future.set_result(message)
+                continue
+
+            self._drop_stale_notice()
+            if self._notice is None:
+                continue
+            notice, delete_after, _ = self._notice
+            self._notice = None
+            try:
+                with metrics.time('kkeutmal_discord_seconds', operation='send'):
+                    message = await self.channel.send(embed=notice)
+                self.delete(message, delete_after)
+            except nextcord.HTTPException as e:
+                log.error(f'Failed to send a notice to channel {self.channel.id}: {e}')
+
+    async def _delete_loop(self) -> None:
+        while self._deletions:
+            now = time.monotonic()
+            due = [message for due_at, message in self._deletions if due_at <= now]
+            if not due:
+                self._deletion_added.clear()
+                try:
+                    await asyncio.wait_for(self._deletion_added.wait(),
+                                           min(due_at for due_at, _ in self._deletions) - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Bulk deletes take at most 100 messages
+            due = due[:100]
+            due_ids = {message.id for message in due}
+            self._deletions = [(due_at, message) for due_at, message in self._deletions if message.id not in due_ids]
+            if not self._bulk_delete:
+                await self._delete_one_by_one(due)
+                continue
+            await self._delete_bucket.acquire()
+            try:
+                with metrics.time('kkeutmal_discord_seconds', operation='bulk_delete'):
+                    await self.channel.delete_messages(due)
+            except nextcord.NotFound:
+                # One of them is already gone, which fails the whole bulk delete
+                await self._delete_one_by_one(due)
+            except nextcord.Forbidden:
+                self._bulk_delete = False
+                await self._delete_one_by_one(due)
+            except nextcord.HTTPException as e:
+                log.error(f'Failed to delete {len(due)} messages in channel {self.channel.id}: {e}')
+
+    async def _delete_one_by_one(self, messages: List[nextcord.abc.Snowflake]) -> None:
+        for message in messages:
+            await self._delete_bucket.acquire()
+            try:
+                with metrics.time('kkeutmal_discord_seconds', operation='delete'):
+                    await self.channel.get_partial_message(message.id).delete()
+            except nextcord.NotFound:
+                pass
+            except nextcord.HTTPException as e:
+                log.error(f'Failed to delete message {message.id} in channel {self.channel.id}: {e}')
+
+    def close(self) -> None:
+        for task in (self._send_task, self._delete_task):
+            if task is not None:
+                task.cancel()
+        for _, future in self._sends:
+            future.cancel()
+
+
+class Outbox:
+    """
+    Schedules the messages the game sends to word chain channels, one ChannelOutbox per channel.
+    Discord allows 5 messages per 5 seconds per channel.
+    """
+
+    def __init__(self, rate: int = 5, period: float = 5.0, stale_after: float = 3.0, delete_delay: float = 0.5) -> None:
+        self.rate = rate
+        self.period = period
+        self.stale_after = stale_after
+        self.delete_delay = delete_delay
+        self._channels: Dict[int, ChannelOutbox] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(channel.pending for channel in self._channels.values())
+
+    def _channel(self, channel: nextcord.TextChannel) -> ChannelOutbox:
+        outbox = self._channels.get(channel.id)
+        if outbox is None:
+            outbox = self._channels[channel.id] = ChannelOutbox(channel, self.rate, self.period, self.stale_after,
+                                                                self.delete_delay)
+        return outbox
+
+    async def send(self, channel: nextcord.TextChannel, **kwargs: Any) -> nextcord.Message:
+        """
+        Sends a message ahead of any queued notices and waits for it to be sent.
+        """
+        return await self._channel(channel).send(**kwargs)
+
+    def notify(self, channel: nextcord.TextChannel, embed: nextcord.Embed, delete_after: float = 5) -> None:
+        """
+        Queues a short-lived notice that replaces any notice still waiting in the channel.
+        """
+        self._channel(channel).notify(embed, delete_after)
+
+    def delete(self, message: nextcord.Message) -> None:
+        self._channel(message.channel).delete(message)
+
+    def close(self) -> None:
+        for channel in self._channels.values():
+            channel.close()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import nextcord
+
+from bot.db import AsyncDB
+from bot.embeds import SimpleEmbed
+from bot.korean import eh_or_ehro, el_or_rel, initial_letter, word_with_initial
+from bot.metrics import metrics
+from bot.outbox import Outbox
+from bot.solver import Solver
+
+embed = SimpleEmbed()
+
+
+class SoloSession:
+    def __init__(self, start_word: str) -> None:
+        self.used_words: Set[str] = set()
+        self.last_word = start_word
+        self.player_words = 0
+        self.last_active = time.monotonic()
+        self.add_word(start_word)
+
+    def add_word(self, word: str) -> None:
+        self.used_words.add(word)
+        self.last_word = word
+        self.last_active = time.monotonic()
+
+    def accepts(self, word: str) -> bool:
+        last_char = self.last_word[-1]
+        return word[0] == last_char or word[0] == initial_letter(last_char)
+
+
+class SoloGames:
+    """
+    Solo games against the bot, one per player and channel. The bot's replies come from a Solver,
+    so answering a move is a few dictionary lookups and never waits on the database.
+    """
+
+    def __init__(self, db: AsyncDB, outbox: Outbox, idle_timeout: float = 300.0) -> None:
+        self.db = db
+        self.outbox = outbox
+        self.idle_timeout = idle_timeout
+        self.solver = Solver(db.lexicon)
+        self.sessions: Dict[Tuple[int, int], SoloSession] = {}
+
+    async def refresh(self) -> None:
+        """
+        Solves the current lexicon again if it was reloaded, off the event loop.
+        """
+        lexicon = self.db.lexicon
+        if self.solver.lexicon is not lexicon:
+            self.solver = await asyncio.to_thread(Solver, lexicon)
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, session in self.sessions.items() if now - session.last_active > self.idle_timeout]:
+            del self.sessions[key]
+
+    def start(self, channel_id: int, user_id: int) -> str:
+        """
+        Starts a new game for the player in the channel, replacing any running one, and returns the first word.
+        """
+        self._purge()
+        start_word = self.db.find_valid_starting_word()
+        self.sessions[(channel_id, user_id)] = SoloSession(start_word)
+        return start_word
+
+    def _session(self, channel_id: int, user_id: int) -> Optional[SoloSession]:
+        session = self.sessions.get((channel_id, user_id))
+        if session is not None and time.monotonic() - session.last_active > self.idle_timeout:
+            del self.sessions[(channel_id, user_id)]
+            return None
+        return session
+
+    def _reject(self, session: SoloSession, word: str) -> Optional[nextcord.Embed]:
+        if len(word) < 2:
+            return embed.error('2글자 이상의 단어를 입력해주세요.')
+        if not session.accepts(word):
+            last_char = session.last_word[-1]
+            return embed.error(f'"**{word_with_initial(last_char)}**"{eh_or_ehro(last_char)} 시작하는 단어를 입력해주세요.')
+        if word in session.used_words:
+            return embed.error('이미 사용된 단어입니다.')
+        if not self.db.word_exists(word):
+            return embed.error('존재하지 않는 단어입니다.')
+        return None
+
+    async def on_message(self, message: nextcord.Message) -> None:
+        if message.author.bot or message.content.startswith('> '):
+            return
+        key = (message.channel.id, message.author.id)
+        session = self._session(*key)
+        if session is None:
+            return
+
+        word = message.content.strip()
+        rejection = self._reject(session, word)
+        if rejection is not None:
+            self.outbox.notify(message.channel, rejection)
+            return
+
+        # The session is fully updated before the first await, so a quick second message sees the bot's reply
+        session.add_word(word)
+        session.player_words += 1
+        with metrics.time('kkeutmal_solo_reply_seconds'):
+            reply = self.solver.reply(word[-1], session.used_words)
+
+        if reply is None:
+            del self.sessions[key]
+            await self.outbox.send(message.channel, embed=nextcord.Embed(
+                title='승리!', description=f'더이상 "**{word_with_initial(word)}**"{el_or_rel(word[-1])} 이을 수 있는 단어가 '
+                                         f'없습니다. 봇을 이겼습니다!', color=0x3598DA).set_footer(
+                text=f'입력한 단어 수: {session.player_words}'))
+            return
+
+        session.add_word(reply)
+        # Counted from the solver's words, which leaves out the one-syllable words the player can't play
+        player_can_continue = self.solver.reply(reply[-1], session.used_words) is not None
+        if not player_can_continue:
+            del self.sessions[key]
+
+        definition = (await self.db.get_definitions(reply))[0]
+        reply_embed = nextcord.Embed(title=f'{word_with_initial(word)} → {word_with_initial(reply)}',
+                                     description=definition.description_text, color=0x2B2D31)
+        reply_embed.add_field(name='뜻풀이', value=SimpleEmbed.format_def(definition), inline=False)
+        if player_can_continue:
+            reply_embed.set_footer(text=f'입력한 단어 수: {session.player_words}')
+        else:
+            reply_embed.add_field(name='게임 오버!', value=f'"**{word_with_initial(reply)}**"{el_or_rel(reply[-1])} '
+                                                       f'이을 수 있는 단어가 없습니다. 봇이 이겼습니다!', inline=False)
+            reply_embed.set_footer(text=f'최종 입력한 단어 수: {session.player_words}')
+        await self.outbox.send(message.channel, embed=reply_embed)
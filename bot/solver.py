@@ -0,0 +1,128 @@
+import random
+from collections import defaultdict, deque
+from typing import AbstractSet, Dict, List, Optional, Set
+
+from bot.korean import initial_letter
+from bot.lexicon import Lexicon
+
+WIN = 'win'
+LOSE = 'lose'
+UNKNOWN = 'unknown'
+
+
+class Solver:
+    """
+    Picks the bot's replies in solo games from a precomputed analysis of the lexicon's syllable graph.
+
+    A position is the syllable the next word has to start with (or its initial letter law alternate), and each word
+    is a move to its last syllable. Working backwards from syllables no word starts with, every position is solved
+    as lost for the player to move (every move leads to a won position), won (some move leads to a lost one)
+    or unknown when it sits on a cycle. The analysis ignores that words can't be used twice, which only matters
+    once a game has used up most words of a syllable, and the reply falls back to the next best word then.
+    One-syllable words are left out altogether, since players can't play them.
+    """
+
+    MIN_LENGTH = 2
+
+    def __init__(self, lexicon: Lexicon, seed: Optional[int] = None) -> None:
+        self.lexicon = lexicon
+        self._random = random.Random(seed)
+        self.successors: Dict[str, Set[str]] = {}
+        self.outcome: Dict[str, str] = {}
+        self.depth: Dict[str, int] = {}
+        self._ranked: Dict[str, List[str]] = {}
+        self.words_by_first_char: Dict[str, List[str]] = {
+            char: [word for word in words if len(word) >= self.MIN_LENGTH]
+            for char, words in lexicon.by_first_char.items()}
+        self._solve()
+
+    def moves_from(self, char: str) -> List[str]:
+        """
+        The characters a word may start with after a word ending in char.
+        """
+        alternate = initial_letter(char)
+        return [char, alternate] if alternate is not None and alternate != char else [char]
+
+    def _solve(self) -> None:
+        transitions: Dict[str, Set[str]] = {char: {word[-1] for word in words}
+                                            for char, words in self.words_by_first_char.items()}
+        positions = set(transitions)
+        for last_chars in transitions.values():
+            positions.update(last_chars)
+
+        predecessors: Dict[str, Set[str]] = defaultdict(set)
+        for position in positions:
+            successors = set()
+            for first_char in self.moves_from(position):
+                successors.update(transitions.get(first_char, ()))
+            self.successors[position] = successors
+            for successor in successors:
+                predecessors[successor].add(position)
+
+        # Retrograde analysis: a position is lost once every move from it is known to lead to a won position
+        remaining = {position: len(successors) for position, successors in self.successors.items()}
+        queue = deque()
+        for position, count in remaining.items():
+            if count == 0:
+                self.outcome[position] = LOSE
+                self.depth[position] = 0
+                queue.append(position)
+
+        while queue:
+            position = queue.popleft()
+            for predecessor in predecessors[position]:
+                if predecessor in self.outcome:
+                    continue
+                if self.outcome[position] == LOSE:
+                    self.outcome[predecessor] = WIN
+                    self.depth[predecessor] = self.depth[position] + 1
+                    queue.append(predecessor)
+                else:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0:
+                        self.outcome[predecessor] = LOSE
+                        self.depth[predecessor] = self.depth[position] + 1
+                        queue.append(predecessor)
+
+        for position in positions:
+            self.outcome.setdefault(position, UNKNOWN)
+
+    def _rank(self, word: str) -> tuple:
+        # Leave the opponent in a lost position as fast as possible, else with as few replies as possible,
+        # and if every reply loses, drag the game out
+        position = word[-1]
+        outcome = self.outcome.get(position, LOSE)
+        if outcome == LOSE:
+            return 0, self.depth.get(position, 0)
+        if outcome == UNKNOWN:
+            return 1, len(self.successors.get(position, ()))
+        return 2, -self.depth[position]
+
+    def ranked_words(self, char: str) -> List[str]:
+        """
+        Every word that may follow char, best reply first. Built on first use for each syllable.
+        """
+        ranked = self._ranked.get(char)
+        if ranked is None:
+            words = [word for first_char in self.moves_from(char)
+                     for word in self.words_by_first_char.get(first_char, ())]
+            # Shuffled first so that equally good replies vary between games
+            self._random.shuffle(words)
+            words.sort(key=self._rank)
+            ranked = self._ranked[char] = words
+        return ranked
+
+    def reply(self, last_char: str, used_words: AbstractSet[str]) -> Optional[str]:
+        """
+        The best unused word to follow a word ending in last_char, or None if there is none.
+        """
+        for word in self.ranked_words(last_char):
+            if word not in used_words:
+                return word
+        return None
+
+    def outcome_of(self, char: str) -> str:
+        """
+        WIN, LOSE or UNKNOWN for the player who has to follow a word ending in char.
+        """
+        return self.outcome.get(char, LOSE)
@@ -0,0 +1,87 @@
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+
+# Where migrate_user_words keeps a legacy used_words map while its counts are being written
+MIGRATING_FIELD = 'used_words_migrating'
+
+
+def ensure_user_word_indexes(user_words: Collection) -> None:
+    user_words.create_index([('user_id', ASCENDING), ('word', ASCENDING)], unique=True)
+    user_words.create_index([('user_id', ASCENDING), ('count', DESCENDING)])
+
+
+def increment_operations(increments: Mapping[Tuple[int, str], int]) -> List[UpdateOne]:
+    """
+    One upsert per (user_id, word), adding to the number of times the user played the word.
+    """
+    return [UpdateOne({'user_id': user_id, 'word': word}, {'$inc': {'count': count}}, upsert=True)
+            for (user_id, word), count in increments.items() if count]
+
+
+def favorite_words(user_words: Collection, user_id: int, count: int,
+                   pending: Optional[Mapping[str, int]] = None) -> List[Tuple[str, int]]:
+    """
+    The user's count most played words with their counts, read from the (user_id, count) index.
+    pending are counts not written yet. A pending word outside the stored top can still overtake it,
+    so the stored counts of those words are looked up too.
+    """
+    projection = {'_id': 0, 'word': 1, 'count': 1}
+    counts: Dict[str, int] = {doc['word']: doc['count'] for doc in
+                              user_words.find({'user_id': user_id}, projection).sort('count', DESCENDING).limit(count)}
+    if pending:
+        missing = [word for word in pending if word not in counts]
+        if missing:
+            for doc in user_words.find({'user_id': user_id, 'word': {'$in': missing}}, projection):
+                counts[doc['word']] = doc['count']
+        for word, pending_count in pending.items():
+            counts[word] = counts.get(word, 0) + pending_count
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def legacy_operations(user_id: int, used_words: Mapping[str, int]) -> List[UpdateOne]:
+    """
+    Adds the counts of a legacy used_words map to user_words. Each document is marked as it gets its legacy count,
+    so running the same map again leaves it alone.
+    """
+    return [UpdateOne({'user_id': user_id, 'word': word},
+                      [{'$set': {'count': {'$cond': [{'$eq': ['$legacy_migrated', True]}, '$count',
+                                                     {'$add': [{'$ifNull': ['$count', 0]}, count]}]},
+                                 'legacy_migrated': True}}],
+                      upsert=True)
+            for word, count in used_words.items()]
+
+
+def migrate_user_words(users: Collection, user_words: Collection, batch_size: int = 1000) -> int:
+    """
+    Moves the used_words maps that older versions kept in the user documents into the user_words collection,
+    and returns the number of users migrated.
+    Each map is first renamed to MIGRATING_FIELD in one atomic update, then its counts are written, and only then
+    is it removed. A migration that stopped halfway resumes the maps it set aside, and the counts written
+    the first time are not added again. Counts the bot writes meanwhile are added on top.
+    """
+    ensure_user_word_indexes(user_words)
+    projection = {'_id': 0, MIGRATING_FIELD: 1, 'total_words': 1}
+    migrated = 0
+    query = {'$or': [{'used_words': {'$exists': True}}, {MIGRATING_FIELD: {'$exists': True}}]}
+    for doc in users.find(query, {'_id': 0, 'user_id': 1}):
+        user_id = doc['user_id']
+        legacy = users.find_one_and_update(
+            {'user_id': user_id, 'used_words': {'$exists': True}, MIGRATING_FIELD: {'$exists': False}},
+            {'$rename': {'used_words': MIGRATING_FIELD}}, projection=projection, return_document=ReturnDocument.AFTER)
+        if legacy is None:
+            legacy = users.find_one({'user_id': user_id, MIGRATING_FIELD: {'$exists': True}}, projection)
+            if legacy is None:
+                continue
+        used_words = legacy.get(MIGRATING_FIELD) or {}
+        if 'total_words' not in legacy:
+            users.update_one({'user_id': user_id, 'total_words': {'$exists': False}},
+                             {'$set': {'total_words': sum(used_words.values())}})
+
+        operations = legacy_operations(user_id, used_words)
+        for start in range(0, len(operations), batch_size):
+            user_words.bulk_write(operations[start:start + batch_size], ordered=False)
+        users.update_one({'user_id': user_id}, {'$unset': {MIGRATING_FIELD: ''}})
+        migrated += 1
+    return migrated
@@ -1,62 +1,139 @@
+import argparse
+import gzip
 import os
-import subprocess
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-
-
-def list_docker_containers():
-    """ List all running Docker containers. """
-    result = subprocess.run(['docker', 'ps', '--format', '{{.Names}}'], capture_output=True, text=True)
-    return result.stdout.splitlines()
-
-
-def select_container(containers):
-    """ Let the user choose a container. """
-    print("Available Docker containers:")
-    for i, container in enumerate(containers):
-        print(f"{i + 1}. {container}")
-    choice = input("Select the container number: ").strip()
-    return containers[int(choice) - 1]
-
-
-def main():
-    # Get the current date and time in the specified format
-    date_format = "%Y%m%d-%H%M%S"
-    current_date = datetime.now().strftime(date_format)
-
-    # Create backup directory if it doesn't exist
-    backup_dir = "backup"
-    os.makedirs(backup_dir, exist_ok=True)
-
-    # List Docker containers
-    containers = list_docker_containers()
-    if not containers:
-        print("No running Docker containers found.")
-        return
-
-    mongo_container = select_container(containers)
-
-    # MongoDB backup command
-    mongodb_backup_dir = f"mongodb_backup_{current_date}"
-    mongodb_backup_cmd = (f"docker exec {mongo_container} mongodump --archive=/data/db/{mongodb_backup_dir}.archive")
-
-    # Execute the MongoDB backup command
-    print("Starting MongoDB backup...")
-    subprocess.run(mongodb_backup_cmd, shell=True, check=True)
-
-    # Copy backup from container to host
-    copy_cmd = (f"docker cp {mongo_container}:/data/db/{mongodb_backup_dir}.archive {backup_dir}/")
-    subprocess.run(copy_cmd, shell=True, check=True)
-
-    print("Backup completed successfully.")
-
-    # Remove backup from container
-    remove_cmd = (f"docker exec {mongo_container} rm -rf /data/db/{mongodb_backup_dir}.archive")
-
-    print("Removing backup from container...")
-    subprocess.run(remove_cmd, shell=True, check=True)
-
-    print("Backup removed from container successfully.")
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+from pymongo.database import Database
+
+MANIFEST = 'manifest.json'
+RAW = CodecOptions(document_class=RawBSONDocument)
+
+
+class Progress:
+    """
+    Thread-safe document and byte counters that print the running throughput.
+    """
+
+    def __init__(self, total: Optional[int] = None) -> None:
+        self.total = total
+        self.documents = 0
+        self.bytes = 0
+        self.started_at = time.monotonic()
+        self._lock = Lock()
+
+    def add(self, documents: int, size: int) -> None:
+        with self._lock:
+            self.documents += documents
+            self.bytes += size
+            elapsed = time.monotonic() - self.started_at
+            total = f'/{self.total}' if self.total else ''
+            print(f'{self.documents}{total} documents, {self.bytes / 1e6:.1f}MB '
+                  f'({self.documents / elapsed if elapsed else 0:.0f} docs/sec, '
+                  f'{self.bytes / 1e6 / elapsed if elapsed else 0:.1f}MB/sec)', flush=True)
+
+
+def index_specs(db: Database, name: str) -> List[Dict[str, Any]]:
+    """
+    The collection's indexes other than _id, as JSON that restore.py can pass back to create_index.
+    """
+    specs = []
+    for index in db[name].list_indexes():
+        if index['name'] == '_id_':
+            continue
+        options = {key: value for key, value in index.items() if key not in ('v', 'ns', 'key')}
+        specs.append({'key': list(index['key'].items()), 'options': options})
+    return specs
+
+
+def dump_collection(db: Database, name: str, directory: str, chunk_size: int, compress_level: int,
+                    progress: Progress) -> Dict[str, Any]:
+    """
+    Streams the raw BSON of every document into gzip-compressed chunk files of at most chunk_size documents.
+    Documents are never decoded, so the dump keeps every BSON type exactly as stored.
+    """
+    chunks = []
+    count = 0
+    output = None
+    chunk_documents = chunk_bytes = 0
+
+    def close_chunk() -> None:
+        output.close()
+        progress.add(chunk_documents, chunk_bytes)
+
+    try:
+        for document in db.get_collection(name, codec_options=RAW).find(batch_size=1000):
+            if output is None or chunk_documents >= chunk_size:
+                if output is not None:
+                    close_chunk()
+                chunk_name = f'{name}.{len(chunks):05d}.bson.gz'
+                chunks.append(chunk_name)
+                output = gzip.open(os.path.join(directory, chunk_name), 'wb', compresslevel=compress_level)
+                chunk_documents = chunk_bytes = 0
+            output.write(document.raw)
+            chunk_documents += 1
+            chunk_bytes += len(document.raw)
+            count += 1
+    finally:
+        if output is not None:
+            close_chunk()
+
+    options = db[name].options()
+    return {'count': count, 'chunks': chunks, 'indexes': index_specs(db, name),
+            'options': {key: value for key, value in options.items() if key in ('capped', 'size', 'max')}}
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Backs up a MongoDB database to compressed BSON chunks.')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    arg_parser.add_argument('--database', default='kkeutmal')
+    arg_parser.add_argument('--collections', nargs='*', help='collections to back up (default: all)')
+    arg_parser.add_argument('--out-dir', default='backup', help='directory the backup folder is created in')
+    arg_parser.add_argument('--chunk-size', type=int, default=100000, help='documents per chunk file')
+    arg_parser.add_argument('--workers', type=int, default=4, help='collections dumped at the same time')
+    arg_parser.add_argument('--compress-level', type=int, default=6, choices=range(1, 10))
+    args = arg_parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)[args.database]
+    names = args.collections or sorted(name for name in db.list_collection_names() if not name.startswith('system.'))
+    total = sum(db[name].estimated_document_count() for name in names)
+
+    backup_name = f"{args.database}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    directory = os.path.join(args.out_dir, backup_name)
+    # Written under a temporary name, so a folder without the suffix is always a complete backup
+    temp_directory = f'{directory}.partial'
+    os.makedirs(temp_directory)
+
+    print(f'Backing up {len(names)} collections ({total} documents) of {args.database} to {directory}')
+    progress = Progress(total)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {name: executor.submit(dump_collection, db, name, temp_directory, args.chunk_size,
+                                             args.compress_level, progress) for name in names}
+            collections = {name: future.result() for name, future in futures.items()}
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+    # Extended JSON, since index options such as partial filters can hold any BSON value
+    with open(os.path.join(temp_directory, MANIFEST), 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps({'database': args.database, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                                 'format': 'bson.gz', 'collections': collections}, ensure_ascii=False, indent=2))
+    os.rename(temp_directory, directory)
+
+    elapsed = time.monotonic() - progress.started_at
+    size = sum(entry.stat().st_size for entry in os.scandir(directory))
+    print(f'Backed up {progress.documents} documents in {elapsed:.1f}s, '
+          f'{progress.bytes / 1e6:.1f}MB compressed to {size / 1e6:.1f}MB')
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,26 @@
+import argparse
+import os
+import sys
+import time
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.user_words import migrate_user_words
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Moves the used_words maps of the user documents '
+                                                     'into the user_words collection.')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    arg_parser.add_argument('--batch-size', type=int, default=1000, help='word counts per bulk write')
+    args = arg_parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)['kkeutmal']
+    started_at = time.monotonic()
+    count = migrate_user_words(db['users'], db['user_words'], args.batch_size)
+    print(f"Migrated the words of {count} users in {time.monotonic() - started_at:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,140 @@
+import argparse
+import gzip
 import os
-import subprocess
-
-
-def list_docker_containers():
-    """ List all running Docker containers. """
-    result = subprocess.run(['docker', 'ps', '--format', '{{.Names}}'], capture_output=True, text=True)
-    return result.stdout.splitlines()
-
-
-def list_backup_files(backup_dir):
-    """ List all files in the backup directory. """
-    return [f for f in os.listdir(backup_dir) if os.path.isfile(os.path.join(backup_dir, f))]
-
-
-def select_container(containers):
-    """ Let the user choose a container. """
-    print("Available Docker containers:")
-    for i, container in enumerate(containers):
-        print(f"{i + 1}. {container}")
-    choice = input("Select the container number: ").strip()
-    return containers[int(choice) - 1]
-
-
-def select_backup_file(backup_files):
-    """ Let the user choose a backup file. """
-    print("Available backup files:")
-    for i, file in enumerate(backup_files):
-        print(f"{i + 1}. {file}")
-    choice = input("Select the backup file number: ").strip()
-    return backup_files[int(choice) - 1]
-
-
-def main():
-    backup_dir = "backup"
-
-    # Check if backup directory exists
-    if not os.path.exists(backup_dir) or not os.listdir(backup_dir):
-        print("No backups found.")
-        return
-
-    # List backup files
-    backup_files = list_backup_files(backup_dir)
-    backup_file = select_backup_file(backup_files)
-
-    # List Docker containers
-    containers = list_docker_containers()
-    if not containers:
-        print("No running Docker containers found.")
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Dict, Iterator, List
+
+from bson import decode_file_iter, json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel, MongoClient
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+MANIFEST = 'manifest.json'
+RAW = CodecOptions(document_class=RawBSONDocument)
+DUPLICATE_KEY = 11000
+
+
+class Progress:
+    """
+    Thread-safe counters of inserted and skipped documents that print the running throughput.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.inserted = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self._lock = Lock()
+        self._printed_at = 0.0
+
+    def add(self, inserted: int, skipped: int) -> None:
+        with self._lock:
+            self.inserted += inserted
+            self.skipped += skipped
+            now = time.monotonic()
+            if now - self._printed_at >= 1 or self.inserted + self.skipped == self.total:
+                self._printed_at = now
+                elapsed = now - self.started_at
+                done = self.inserted + self.skipped
+                print(f'{done}/{self.total} documents ({done / self.total * 100 if self.total else 100:.0f}%, '
+                      f'{self.inserted / elapsed if elapsed else 0:.0f} docs/sec)', flush=True)
+
+
+def latest_backup(backup_dir: str) -> str:
+    backups = sorted(entry.path for entry in os.scandir(backup_dir)
+                     if entry.is_dir() and os.path.exists(os.path.join(entry.path, MANIFEST)))
+    if not backups:
+        raise SystemExit(f'No complete backups in {backup_dir}')
+    return backups[-1]
+
+
+def read_chunk(path: str, batch_size: int) -> Iterator[List[RawBSONDocument]]:
+    with gzip.open(path, 'rb') as f:
+        batch = []
+        for document in decode_file_iter(f, codec_options=RAW):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def restore_chunk(db: Database, name: str, path: str, batch_size: int, progress: Progress) -> None:
+    """
+    Inserts a chunk file with unordered bulk inserts. Documents that already exist are skipped and counted,
+    so restoring over a partial earlier restore picks up where it stopped.
+    """
+    collection = db[name]
+    for batch in read_chunk(path, batch_size):
+        try:
+            collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+            progress.add(len(batch), 0)
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(error['code'] != DUPLICATE_KEY for error in errors):
+                raise
+            progress.add(e.details['nInserted'], len(errors))
+
+
+def create_indexes(db: Database, name: str, specs: List[Dict[str, Any]]) -> None:
+    if not specs:
         return
-
-    mongo_container = select_container(containers)
-
-    # MongoDB restore command
-    mongodb_restore_cmd = (f"docker cp {backup_dir}/{backup_file} {mongo_container}:/data/db/backup.archive && "
-                           f"docker exec {mongo_container} mongorestore --archive=/data/db/backup.archive")
-
-    # Execute the MongoDB restore command
-    print("Starting MongoDB restore...")
-    subprocess.run(mongodb_restore_cmd, shell=True, check=True)
-
-    print("Restore completed successfully.")
+    db[name].create_indexes([IndexModel([tuple(pair) for pair in spec['key']], **spec['options'])
+                             for spec in specs])
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Restores a backup made by backup.py.')
+    arg_parser.add_argument('backup', nargs='?', help='backup folder (default: the latest one in --backup-dir)')
+    arg_parser.add_argument('--backup-dir', default='backup')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    arg_parser.add_argument('--database', help='database to restore into (default: the one that was backed up)')
+    arg_parser.add_argument('--collections', nargs='*', help='collections to restore (default: all)')
+    arg_parser.add_argument('--drop', action='store_true', help='drop each collection before restoring it')
+    arg_parser.add_argument('--workers', type=int, default=8, help='chunk files inserted at the same time')
+    arg_parser.add_argument('--batch-size', type=int, default=1000, help='documents per insert_many')
+    args = arg_parser.parse_args()
+
+    directory = args.backup or latest_backup(args.backup_dir)
+    with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json_util.loads(f.read())
+    collections = {name: entry for name, entry in manifest['collections'].items()
+                   if not args.collections or name in args.collections}
+
+    db = MongoClient(args.mongo_uri)[args.database or manifest['database']]
+    print(f'Restoring {len(collections)} collections from {directory} into {db.name}')
+
+    existing = set(db.list_collection_names())
+    for name, entry in collections.items():
+        if args.drop and name in existing:
+            db.drop_collection(name)
+            existing.discard(name)
+        if name not in existing:
+            db.create_collection(name, **entry['options'])
+
+    # Indexes are built once after the load instead of being updated on every insert
+    progress = Progress(sum(entry['count'] for entry in collections.values()))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(restore_chunk, db, name, os.path.join(directory, chunk), args.batch_size, progress)
+                   for name, entry in collections.items() for chunk in entry['chunks']]
+        for future in futures:
+            future.result()
+    load_elapsed = time.monotonic() - progress.started_at
+    print(f'Inserted {progress.inserted} documents in {load_elapsed:.1f}s '
+          f'({progress.inserted / load_elapsed if load_elapsed else 0:.0f} docs/sec), '
+          f'skipped {progress.skipped} that already existed')
+
+    for name, entry in collections.items():
+        index_started_at = time.monotonic()
+        create_indexes(db, name, entry['indexes'])
+        print(f"{name}: built {len(entry['indexes'])} indexes in {time.monotonic() - index_started_at:.1f}s")
+    print('Restore completed successfully.')
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
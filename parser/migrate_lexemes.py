@@ -0,0 +1,25 @@
+import argparse
+import os
+import sys
+import time
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.lexemes import rebuild_lexemes
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Builds the lexemes collection from the words collection.')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    arg_parser.add_argument('--batch-size', type=int, default=1000, help='lexemes per bulk write')
+    args = arg_parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)['kkeutmal']
+    started_at = time.monotonic()
+    count = rebuild_lexemes(db['words'], db['lexemes'], args.batch_size)
+    print(f"Built {count} lexemes in {time.monotonic() - started_at:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,27 @@
 import os
 import json
 import re
-from typing import Union, Optional, List, Dict, Any
+import time
+import argparse
+import hashlib
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from datetime import datetime
+from itertools import islice
+from typing import Union, Optional, List, Dict, Any, Iterator, Set, Deque, Tuple, Callable
 from pymongo import MongoClient, ASCENDING, UpdateOne
+from pymongo.collection import Collection
+
+# The lexicon file format and the lexemes collection live with the bot that reads them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.lexemes import lexemes_complete, rebuild_lexemes
+from bot.lexicon_file import is_current, write_lexicon_file
+
+word_number_pattern = re.compile(r'(\d+)$')
+parentheses_pattern = re.compile(r'\([^)]*\)')
+brackets_pattern = re.compile(r'\[[^)]*]')
+
 
 def exist_or_none(dictionary: Dict[str, Any], key: str) -> Optional[Union[str, int, List[Any]]]:
     """
@@ -15,7 +34,7 @@ class Word:
     def __init__(self, word_dict: Dict[str, Any]) -> None:
         # Parsing the word with potential numeric suffix
         raw_word = word_dict['word']
-        match = re.search(r'(\d+)$', raw_word)
+        match = word_number_pattern.search(raw_word)
         if match:
             self.word = raw_word[:match.start()]
             self.word_number = int(match.group())
@@ -25,9 +44,9 @@ class Word:
 
         self.word = self.word.replace('-', '').replace('^', '').replace(' ', '').strip()
         # remove () parentheses and their contents
-        self.word = re.sub(r'\([^)]*\)', '', self.word)
+        self.word = parentheses_pattern.sub('', self.word)
         # remove [] parentheses and their contents
-        self.word = re.sub(r'\[[^)]*]', '', self.word)
+        self.word = brackets_pattern.sub('', self.word)
 
         # More robust handling of pronunciations
         pronunciations = word_dict.get('pronunciation_info', [])
@@ -76,57 +95,314 @@ class Word:
         return string_value
 
 
-def save_to_mongodb(data, collection):
+def iter_items(path: str, chunk_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
     """
-    Saves processed word data to MongoDB using bulk operations for efficiency.
-    Using 'word' and 'word_number' as a compound index for uniqueness.
+    Streams the entries of the channel.item array of a dictionary file one at a time,
+    so memory use stays bounded by chunk_size instead of the size of the file.
     """
-    operations = []  # Accumulate operations in a list
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def read_more() -> bool:
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            # Drop consumed text so the buffer doesn't grow with the file
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        # Skip the channel header up to the opening bracket of the item array
+        while True:
+            key_index = buffer.find('"item"')
+            if key_index != -1:
+                bracket_index = buffer.find('[', key_index)
+                if bracket_index != -1:
+                    pos = bracket_index + 1
+                    break
+            if not read_more():
+                raise ValueError(f'{path} has no channel.item array')
+
+        while True:
+            # Skip separators between entries
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buffer) or not read_more():
+                    break
+            if pos >= len(buffer):
+                raise ValueError(f'{path} ended inside the item array')
+            if buffer[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof or not read_more():
+                    raise
+                continue
+            yield item
+            pos = end
 
-    for word_entry in data:
+
+def batched(iterable: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    while True:
+        batch = list(islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+
+def normalize_batch(entries: List[Dict[str, Any]], source_file: str, source_checksum: str) -> List[Dict[str, Any]]:
+    """
+    Converts raw dictionary entries into documents ready for MongoDB. Runs in a worker process.
+    Every document is tagged with the file it came from, so entries removed upstream can be found later.
+    """
+    documents = []
+    for word_entry in entries:
         word_info = Word(word_entry['word_info'])
         # Prepare the data for MongoDB insertion
         document = word_info.__dict__
         document['pronunciations'] = ', '.join(document['pronunciations'])  # Convert list to string
         document['word_number'] = document.get('word_number', None)  # Ensure compatibility
+        document['source_file'] = source_file
+        document['source_checksum'] = source_checksum
+        documents.append(document)
+    return documents
 
-        # Prepare an upsert operation for each document
-        operations.append(UpdateOne(
-            {"word": document["word"], "word_number": document["word_number"]},
-            {"$set": document},
-            upsert=True
-        ))
-
-        # Execute the bulk operation in batches for efficiency
-        if len(operations) >= 500:  # Adjust the batch size to your needs
-            collection.bulk_write(operations, ordered=False)
-            operations.clear()  # Clear the list for the next batch
 
-    # Execute any remaining operations in the final batch
+def write_batch(collection: Collection, documents: List[Dict[str, Any]]) -> int:
+    """
+    Upserts a batch of documents using 'word' and 'word_number' as the compound key.
+    """
+    operations = [UpdateOne({"word": document["word"], "word_number": document["word_number"]},
+                            {"$set": document}, upsert=True)
+                  for document in documents]
     if operations:
         collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """
+    The manifest records, per dictionary file, its checksum and how many batches of it have been written.
+    """
+    if not os.path.exists(path):
+        return {'files': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def handle_stale_words(collection: Collection, source_file: str, source_checksum: Optional[str], prune: bool) -> int:
+    """
+    Reports (and with prune, deletes) the words imported from source_file that are no longer in it.
+    A source_checksum of None means the whole file was removed.
+    """
+    query: Dict[str, Any] = {'source_file': source_file}
+    if source_checksum is not None:
+        query['source_checksum'] = {'$ne': source_checksum}
+    stale = collection.count_documents(query)
+    if stale:
+        if prune:
+            collection.delete_many(query)
+            print(f"{source_file}: removed {stale} words that were deleted upstream")
+        else:
+            print(f"{source_file}: {stale} words were deleted upstream (run with --prune to remove them)")
+    return stale
+
+
+class Importer:
+    """
+    Streams dictionary files through a process pool of normalizers and a thread pool of bulk writers.
+    The number of batches in flight is bounded, so memory use doesn't depend on the file size.
+    """
+
+    def __init__(self, collection: Collection, batch_size: int = 500, workers: int = os.cpu_count() or 1,
+                 writers: int = 4) -> None:
+        self.collection = collection
+        self.batch_size = batch_size
+        self.workers = workers
+        self.writers = writers
+        self.written = 0
+        self.started_at = time.monotonic()
+        self._normalizers = ProcessPoolExecutor(max_workers=workers)
+        self._writer_pool = ThreadPoolExecutor(max_workers=writers)
+        self._normalizing: Deque[Tuple[int, Future]] = deque()
+        self._writing: Dict[Future, int] = {}
+        self._finished_batches: Set[int] = set()
+        self._batches_done = 0
+        self._on_progress: Optional[Callable[[int], None]] = None
+
+    def __enter__(self) -> 'Importer':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._normalizers.shutdown(cancel_futures=True)
+        self._writer_pool.shutdown()
+
+    @property
+    def words_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.written / elapsed if elapsed else 0.0
+
+    def import_file(self, path: str, source_file: str, source_checksum: str, start_batch: int = 0,
+                    on_progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Imports one file, skipping the first start_batch batches that an interrupted run already wrote.
+        on_progress is called with the number of leading batches that are fully written.
+        """
+        written_before = self.written
+        self._finished_batches = set()
+        self._batches_done = start_batch
+        self._on_progress = on_progress
+
+        for index, batch in enumerate(batched(iter_items(path), self.batch_size)):
+            if index < start_batch:
+                continue
+            future = self._normalizers.submit(normalize_batch, batch, source_file, source_checksum)
+            self._normalizing.append((index, future))
+            if len(self._normalizing) >= self.workers * 2:
+                self._start_write()
+        while self._normalizing:
+            self._start_write()
+        self._wait_writes(0)
+        return self.written - written_before
+
+    def _start_write(self) -> None:
+        index, future = self._normalizing.popleft()
+        documents = future.result()
+        self._wait_writes(self.writers * 2 - 1)
+        self._writing[self._writer_pool.submit(write_batch, self.collection, documents)] = index
+
+    def _wait_writes(self, max_pending: int) -> None:
+        while len(self._writing) > max_pending:
+            done, _ = wait(self._writing, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = self._writing.pop(future)
+                self.written += future.result()
+                self._finish_batch(index)
+            print(f"Processed {self.written} words ({self.words_per_second:.0f} words/sec)", end='\r')
+
+    def _finish_batch(self, index: int) -> None:
+        # Writes finish out of order, only a contiguous run of batches is safe to resume after
+        self._finished_batches.add(index)
+        while self._batches_done in self._finished_batches:
+            self._finished_batches.remove(self._batches_done)
+            self._batches_done += 1
+        if self._on_progress is not None:
+            self._on_progress(self._batches_done)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Imports the dictionary JSON files into MongoDB.')
+    arg_parser.add_argument('--dict-dir', default='parser/dict', help='directory with the dictionary JSON files')
+    arg_parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    arg_parser.add_argument('--batch-size', type=int, default=500, help='documents per bulk write')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='normalizer processes')
+    arg_parser.add_argument('--writers', type=int, default=4, help='concurrent bulk writers')
+    arg_parser.add_argument('--manifest', help='import manifest path (default: <dict-dir>/manifest.json)')
+    arg_parser.add_argument('--full', action='store_true', help='re-import every file even if it is unchanged')
+    arg_parser.add_argument('--prune', action='store_true', help='delete words that were removed upstream')
+    arg_parser.add_argument('--lexicon-file', default='bot/lexicon.bin', help='compiled lexicon the bot maps at startup')
+    args = arg_parser.parse_args()
+    manifest_path = args.manifest or os.path.join(args.dict_dir, 'manifest.json')
+
+    # Connection to MongoDB
+    client = MongoClient(args.mongo_uri)
+    db = client['kkeutmal']  # Use your database name
+    collection = db['words']  # Use your collection name
+
+    # Ensure a compound index on 'word' and 'word_number' for rapid membership checks and uniqueness
+    collection.create_index([("word", ASCENDING), ("word_number", ASCENDING)], unique=True)
+    collection.create_index([("source_file", ASCENDING), ("source_checksum", ASCENDING)])
+
+    files = sorted(f for f in os.listdir(args.dict_dir) if f.endswith('.json') and f != os.path.basename(manifest_path))
+    manifest = load_manifest(manifest_path)
+    file_states: Dict[str, Dict[str, Any]] = manifest.setdefault('files', {})
+    changed = False
+
+    with Importer(collection, args.batch_size, args.workers, args.writers) as importer:
+        for file_name in files:
+            checksum = file_checksum(os.path.join(args.dict_dir, file_name))
+            state = file_states.get(file_name)
+            same_file = state is not None and state['sha256'] == checksum
+            if same_file and state['completed'] and not args.full:
+                print(f"{file_name}: unchanged, skipped")
+                continue
+
+            # Resume an interrupted import of the same file, as long as the batches line up
+            start_batch = 0
+            if same_file and not state['completed'] and state['batch_size'] == args.batch_size and not args.full:
+                start_batch = state['batches_done']
+                print(f"{file_name}: resuming after batch {start_batch}")
+
+            state = {'sha256': checksum, 'batch_size': args.batch_size, 'batches_done': start_batch,
+                     'completed': False}
+            file_states[file_name] = state
+            save_manifest(manifest_path, manifest)
+            last_saved = time.monotonic()
+
+            def on_progress(batches_done: int) -> None:
+                nonlocal last_saved
+                state['batches_done'] = batches_done
+                if time.monotonic() - last_saved > 2:
+                    save_manifest(manifest_path, manifest)
+                    last_saved = time.monotonic()
+
+            file_started_at = time.monotonic()
+            count = importer.import_file(os.path.join(args.dict_dir, file_name), file_name, checksum,
+                                         start_batch, on_progress)
+            elapsed = time.monotonic() - file_started_at
+            print(f"{file_name}: {count} words in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} words/sec)")
 
+            state['completed'] = True
+            save_manifest(manifest_path, manifest)
+            handle_stale_words(collection, file_name, checksum, args.prune)
+            changed = True
 
-# Connection to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['kkeutmal']  # Use your database name
-collection = db['words']  # Use your collection name
+        print(f"Imported {importer.written} words at {importer.words_per_second:.0f} words/sec")
 
-# Ensure a compound index on 'word' and 'word_number' for rapid membership checks and uniqueness
-collection.create_index([("word", ASCENDING), ("word_number", ASCENDING)], unique=True)
+    for file_name in [name for name in file_states if name not in files]:
+        if handle_stale_words(collection, file_name, None, args.prune) == 0 or args.prune:
+            del file_states[file_name]
+            changed = True
+    save_manifest(manifest_path, manifest)
 
-files = [f for f in os.listdir('parser/dict') if f.endswith('.json')]
+    if changed or not is_current(args.lexicon_file):
+        word_count = write_lexicon_file(args.lexicon_file, ((doc['word'], doc['_id'].binary)
+                                                            for doc in collection.find({}, {'word': 1})))
+        print(f"Wrote {word_count} words to {args.lexicon_file}")
+        changed = True
 
-count = 0
+    if changed or not lexemes_complete(db['lexemes']):
+        print(f"Built {rebuild_lexemes(collection, db['lexemes'])} lexemes")
+        changed = True
 
-for test_file in files:
-    with open(f'parser/dict/{test_file}', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        data = data['channel']['item']
+    if changed:
+        # Let running bots know the dictionary changed so they reload their lexicon
+        db['metadata'].update_one({'_id': 'words'}, {'$set': {'updated_at': datetime.now()}}, upsert=True)
 
-        # Save processed data to MongoDB
-        save_to_mongodb(data, collection)
-        count += len(data)
 
-        if count % 1000 == 0:
-            print(f"Processed {count} words")
+if __name__ == '__main__':
+    main()